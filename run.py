@@ -1,7 +1,8 @@
 import argparse
-from importlib import import_module
+import shlex
 import yaml
 
+from src.batch import run_operations, create_tasks, run_batch, create_slurm_script
 from version import __version__
 
 
@@ -9,17 +10,52 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(f'BioImageOperation-B {__version__}')
     parser.add_argument('--params',
                         required=True,
-                        help='The parameters file')
+                        nargs='+',
+                        help='The parameters file(s)')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Resume operations from their last checkpoint')
+    parser.add_argument('--datasets',
+                        nargs='+',
+                        help='Batch: dataset folders (or glob patterns), each replacing the base_dir of the parameters')
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Batch: number of parallel processes (default: all cores)')
+    parser.add_argument('--manifest',
+                        default='batch_manifest.jsonl',
+                        help='Batch: file recording completed and failed tasks; completed tasks are skipped')
+    parser.add_argument('--slurm',
+                        help='Batch: write SLURM array job script to this file instead of running')
+    parser.add_argument('--shards',
+                        type=int,
+                        default=1,
+                        help='Batch: number of shards (array tasks) the tasks are divided over')
+    parser.add_argument('--shard',
+                        type=int,
+                        help='Batch: only run the tasks of this shard')
     args = parser.parse_args()
-    with open(args.params, 'r') as file:
-        params = yaml.safe_load(file)
 
-    for operation0 in params['operations']:
-        operation = next(iter(operation0))
-        try:
-            module = import_module(f'src.pipeline.{operation}')
-        except Exception as e:
-            raise FileNotFoundError(f'Unknown operation: {operation}\n{e}')
-        print(f'[Operation: {operation}]')
-        module.run(params, operation0[operation])
-    print('All operations completed')
+    if len(args.params) == 1 and not args.datasets and args.slurm is None and args.shard is None:
+        with open(args.params[0], 'r') as file:
+            params = yaml.safe_load(file)
+        if args.resume:
+            params['general']['resume'] = True
+        run_operations(params)
+        print('All operations completed')
+    else:
+        tasks = create_tasks(args.params, args.datasets)
+        if args.slurm:
+            arguments = ['--params'] + [shlex.quote(params_file) for params_file in args.params]
+            if args.datasets:
+                arguments += ['--datasets'] + [shlex.quote(dataset) for dataset in args.datasets]
+            if args.workers:
+                arguments.append(f'--workers={args.workers}')
+            arguments.append(f'--manifest={shlex.quote(args.manifest)}')
+            if args.resume:
+                arguments.append('--resume')
+            nshards = args.shards if args.shards > 1 else len(tasks)
+            create_slurm_script(args.slurm, arguments, nshards)
+            print(f'Written {args.slurm} ({len(tasks)} tasks in {nshards} shards), submit using: sbatch {args.slurm}')
+        else:
+            run_batch(tasks, args.manifest, workers=args.workers, shard=args.shard, nshards=args.shards,
+                      resume=args.resume)
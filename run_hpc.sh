@@ -10,4 +10,4 @@ ml purge
 ml Anaconda3
 source /camp/apps/eb/software/Anaconda/conda.env.sh
 conda activate bio-b-env
-python run.py --params=resources/params_tracking_hpc.yml
\ No newline at end of file
+python run.py --params=resources/params_tracking_hpc.yml --resume
\ No newline at end of file
@@ -1,16 +1,58 @@
-import math
+import itertools
 import numpy as np
 import os
-from tqdm import tqdm
 
 from src.file.generic import import_file
 from src.file.plain_csv import export_csv
-from src.parameters import PROFILE_HIST_BINS, VANGLE_NORM
-from src.util import get_filetitle, extract_filename_id_info, isvalid_position, create_window, calc_diff
+from src.parameters import PROFILE_HIST_BINS, PROFILE_POWER_RANGES, VANGLE_NORM
+from src.util import get_filetitle, extract_filename_id_info, create_window, create_windows, calc_diff, \
+    calc_path_dist, parallel_map
+
+
+ACTIVITY_TYPES = {'movement_type': ['', 'brownian', 'levi', 'ballistic'],
+                  'movement': ['', 'appendages', 'moving']}
+# output columns of each feature set
+FEATURE_PERCENTILES = [25, 50, 75]
+FEATURE_COLUMNS = {'v_percentiles': [f'v {percentile}% percentile' for percentile in FEATURE_PERCENTILES]}
+
+WINDOW_FEATURES = ['dist', 'v', 'a', 'angle', 'v_angle', 'a_angle', 'projection', 'v_projection', 'area']
+# features calculated from other features when not in the data
+# windowed features: <feature>1 for window_size, <feature>_<size> for each of window_sizes
+FEATURE_DEPENDENCIES = {'dist': ['x', 'y'], 'dist_tot': ['dist'], 'dist_origin': ['x', 'y'],
+                        'v': ['dist'], 'a': ['v'], 'v_angle': ['angle'], 'a_angle': ['v_angle']}
+WINDOW_METHODS = ['fast', 'precise']
+# features included in exported data
+BASIC_FEATURES = ['dist', 'dist_tot', 'dist_origin', 'v', 'a', 'v_angle', 'a_angle']
+
+
+class FeatureData(dict):
+    # per frame feature values; features missing in the data are calculated on first access and stored
+    # iteration only includes the stored features
+    def __init__(self, data, owner):
+        super().__init__(data)
+        self.owner = owner
+
+    def __missing__(self, feature):
+        if not self.is_available(feature):
+            raise KeyError(feature)
+        values = self.owner.calc_feature(feature)
+        self[feature] = values
+        return values
+
+    def __contains__(self, feature):
+        return super().__contains__(feature) or self.is_available(feature)
+
+    def is_available(self, feature):
+        dependencies = self.owner.get_dependencies(feature)
+        return dependencies is not None and all(dependency in self for dependency in dependencies)
+
+    def get(self, feature, default=None):
+        return self[feature] if feature in self else default
 
 
 class Data:
-    def __init__(self, data=None, filename=None, info=None, id=None, fps=1, pixel_size=1, window_size='1s'):
+    def __init__(self, data=None, filename=None, info=None, id=None, fps=1, pixel_size=1, window_size='1s',
+                 window_method='fast', window_sizes=None):
         self.data = data
         self.filename = filename
         self.info = info
@@ -18,6 +60,11 @@ class Data:
         self.fps = fps
         self.pixel_size = pixel_size
         self.window_size = window_size
+        # window method: fast: padded uniform filter; precise: nan-aware means of available frames
+        if window_method not in WINDOW_METHODS:
+            raise ValueError(f'Unknown window method: {window_method}')
+        self.window_method = window_method
+        self.window_sizes = window_sizes if window_sizes is not None else []
 
         if self.filename is not None:
             self.filetitle = get_filetitle(filename)
@@ -38,6 +85,7 @@ class Data:
         if self.has_data:
             self.features = {}
             self.profiles = {}
+            self.activities = {}
             self.calc_basic()
 
         self.new_label = None
@@ -45,7 +93,13 @@ class Data:
 
     def get_frame_data(self, frame):
         if frame in self.frames:
-            return {key: {frame: values[frame]} for key, values in self.data.items()}
+            return {key: {frame: values.get(frame)} for key, values in self.get_export_data().items()}
+
+    def get_export_data(self):
+        # loaded columns followed by the basic features, independent of the features used before
+        features = self.columns + [feature for feature in BASIC_FEATURES
+                                   if feature not in self.columns and feature in self.data]
+        return {feature: self.data[feature] for feature in features}
 
     def set_new_label(self, new_label, match_dist=0):
         self.new_label = new_label
@@ -58,9 +112,9 @@ class Data:
         self.new_title = new_title
 
     def calc_basic(self):
+        # only prepares the data; other features are calculated on first access (see FeatureData)
         data = self.data
         pixel_size = self.pixel_size
-        fps = self.fps
         self.dtime = np.mean(np.diff(list(data['time'].values())))
         if 'frame' in self.data:
             self.frames = list(data['frame'].values())
@@ -69,81 +123,93 @@ class Data:
         self.frames = np.array(self.frames).astype(int)
         self.n = len(self.frames)
 
-        if pixel_size is not None and pixel_size != 1:
-            data['x'] = {frame: value * pixel_size for frame, value in data['x'].items()}
-            data['y'] = {frame: value * pixel_size for frame, value in data['y'].items()}
-
-        positions = {}
-        dist = {}
-        if 'position' not in data or 'dist' not in data:
-            position = None
-            last_position = None
-            for frame, x, y in zip(data['x'].keys(), data['x'].values(), data['y'].values()):
-                if isvalid_position((x, y)):
-                    position = (x, y)
-                    positions[frame] = position
-
-                if 'dist' not in data:
-                    if position is not None:
-                        if last_position is not None:
-                            dist[frame] = math.dist(last_position, position)
-                        last_position = position
-            if 'dist' not in data:
-                data['dist'] = dist
-        if 'position' in data:
-            positions = data['position']
-        self.position = positions
+        self.window_frames = self.get_window_frames(self.window_size)
+        # windowed feature: source feature, window frames
+        self.window_features = {feature + '1': (feature, self.window_frames) for feature in WINDOW_FEATURES}
+        for window_size in self.window_sizes:
+            self.window_features |= {f'{feature}_{window_size}': (feature, self.get_window_frames(window_size))
+                                     for feature in WINDOW_FEATURES}
 
         if pixel_size is not None and pixel_size != 1:
-            data['dist'] = {frame: value * pixel_size for frame, value in data['dist'].items()}
-
-        if 'dist_tot' not in data:
-            dists = {}
-            dist_tot = 0
-            for frame, value in data['dist'].items():
-                dist_tot += value
-                dists[frame] = dist_tot
-            data['dist_tot'] = dists
-
-        if 'dist_origin' not in data:
-            dists = {}
-            origin = None
-            for frame, value in self.position.items():
-                if origin is None:
-                    origin = value
-                dists[frame] = math.dist(value, origin)
-            data['dist_origin'] = dists
-
-        if 'v' not in data and 'dist' in data:
-            data['v'] = {frame: value * fps for frame, value in data['dist'].items()}
-        if 'a' not in data and 'v' in data:
-            data['a'] = calc_diff(data['v'], fps)
-
-        if 'v_angle' not in data and 'angle' in data:
-            data['v_angle'] = calc_diff(data['angle'], fps)
-        if 'a_angle' not in data and 'v_angle' in data:
-            data['a_angle'] = calc_diff(data['v_angle'], fps)
+            for feature in ['x', 'y', 'dist']:
+                if feature in data:
+                    data[feature] = dict(zip(data[feature].keys(),
+                                             (np.array(list(data[feature].values()), dtype=float) * pixel_size).tolist()))
+        self._position = None
+        self.columns = list(data.keys())
+        self.data = FeatureData(data, self)
+
+    @property
+    def position(self):
+        if self._position is None:
+            if 'position' in self.data:
+                self._position = self.data['position']
+            else:
+                frames, x, y = self.get_xy()
+                valid, _ = calc_path_dist(x, y)
+                self._position = dict(zip(itertools.compress(frames, valid),
+                                          zip(x[valid].tolist(), y[valid].tolist())))
+        return self._position
+
+    def get_xy(self):
+        frames = list(self.data['x'].keys())
+        x = np.array(list(self.data['x'].values()), dtype=float)
+        y = np.array(list(self.data['y'].values()), dtype=float)
+        return frames, x, y
+
+    def calc_feature(self, feature):
+        data = self.data
+        pixel_size = self.pixel_size
+        fps = self.fps
+        if feature == 'dist':
+            frames, x, y = self.get_xy()
+            _, dist = calc_path_dist(x, y)
+            if pixel_size is not None and pixel_size != 1:
+                # scaled on top of the scaled positions
+                dist *= pixel_size
+            defined = ~np.isnan(dist)
+            return dict(zip(itertools.compress(frames, defined), dist[defined].tolist()))
+        if feature == 'dist_tot':
+            return dict(zip(data['dist'].keys(), np.cumsum(np.array(list(data['dist'].values()), dtype=float)).tolist()))
+        if feature == 'dist_origin':
+            values = np.array(list(self.position.values()), dtype=float).reshape(-1, 2)
+            dists = np.hypot(values[:, 0] - values[:1, 0], values[:, 1] - values[:1, 1])
+            return dict(zip(self.position.keys(), dists.tolist()))
+        if feature == 'v':
+            return {frame: value * fps for frame, value in data['dist'].items()}
+        if feature in ['a', 'v_angle', 'a_angle']:
+            return calc_diff(data[FEATURE_DEPENDENCIES[feature][0]], fps)
+        return self.calc_window_features([feature])[feature]
+
+    def get_window_frames(self, window_size):
+        window_size = str(window_size)
+        if window_size.endswith('s'):
+            return int(round(int(window_size[:-1].strip()) * self.fps))
+        return int(window_size)
+
+    def get_dependencies(self, feature):
+        if feature in self.window_features:
+            return [self.window_features[feature][0]]
+        return FEATURE_DEPENDENCIES.get(feature)
 
     def calc_windows(self):
-        if self.window_size.endswith('s'):
-            window_size = int(self.window_size[:-1].strip())
-            self.window_frames = int(round(window_size * self.fps))
-        else:
-            self.window_frames = int(self.window_size)
-
-        self.calc_window('dist', 'dist1')
-        self.calc_window('v', 'v1')
-        self.calc_window('a', 'a1')
-        self.calc_window('angle', 'angle1')
-        self.calc_window('v_angle', 'v_angle1')
-        self.calc_window('a_angle', 'a_angle1')
-        self.calc_window('projection', 'projection1')
-        self.calc_window('v_projection', 'v_projection1')
-        self.calc_window('area', 'area1')
-
-    def calc_window(self, source, dest):
-        if dest not in self.data and source in self.data:
-            self.data[dest] = create_window(self.frames, self.data[source], self.window_frames)
+        # all windowed features, otherwise calculated on first access
+        features = [feature for feature in self.window_features
+                    if not dict.__contains__(self.data, feature) and feature in self.data]
+        self.data.update(self.calc_window_features(features))
+
+    def calc_window_features(self, features):
+        if self.window_method == 'precise':
+            # all sources and window sizes in one pass
+            sources = {self.window_features[feature][0] for feature in features}
+            window_sizes = {self.window_features[feature][1] for feature in features}
+            windows = create_windows(self.frames, {source: self.data[source] for source in sources}, window_sizes)
+            return {feature: windows[self.window_features[feature]] for feature in features}
+        windows = {}
+        for feature in features:
+            source, window_frames = self.window_features[feature]
+            windows[feature] = create_window(self.frames, self.data[source], window_frames)
+        return windows
 
     def calc_means(self):
         self.meanx = self.get_mean_feature('x')
@@ -155,40 +221,27 @@ class Data:
     def get_mean_feature(self, feature):
         return np.mean(list(self.data[feature].values()))
 
-    def calc_profiles(self):
+    def calc_profile_values(self):
         v = np.asarray(list(self.data['v'].values()))
         v_angle = np.asarray(list(self.data['v_angle'].values()))
         self.v_norm = v / self.meanl
         self.angle_norm = abs(v_angle) / VANGLE_NORM
-        self.features['v_percentiles'] = {f'v {percentile}% percentile': np.percentile(v, percentile)
-                                          for percentile in [25, 50, 75]}
-        self.profiles['v'] = self.calc_loghist(self.v_norm, -2, 2)
-        self.profiles['vangle'] = self.calc_loghist(self.angle_norm, -3, 1)
+        self.features['v_percentiles'] = dict(zip(FEATURE_COLUMNS['v_percentiles'],
+                                                  np.percentile(v, FEATURE_PERCENTILES)))
+        self.profile_values = {'v': self.v_norm, 'vangle': self.angle_norm}
+
+    def calc_profiles(self):
+        self.calc_profile_values()
+        for profile, (power_min, power_max) in PROFILE_POWER_RANGES.items():
+            self.profiles[profile] = self.calc_loghist(self.profile_values[profile], power_min, power_max)
 
     def calc_hist(self, data, range):
         hist, bin_edges = np.histogram(data, bins=PROFILE_HIST_BINS, range=(0, range))
         return hist / len(data)
 
     def calc_loghist(self, data, power_min, power_max):
-        # assume symtric scale - middle bin is 10^0 = 1
-        #bin_edges = [10 ** ((i - NBINS / 2) * factor) for i in range(NBINS + 1)]
-        bin_edges = np.logspace(power_min, power_max, PROFILE_HIST_BINS + 1)
-
-        # manual histogram, ensuring values at (positive) histogram edges are counted
-        hist = np.zeros(PROFILE_HIST_BINS)
-        factor = (power_max - power_min) / PROFILE_HIST_BINS
-        for x in data:
-            if x != 0:
-                bin = (np.log10(abs(x)) - power_min) / factor
-                if bin >= 0:
-                    # discard low values
-                    bin = np.clip(int(bin), 0, PROFILE_HIST_BINS - 1)
-                    hist[bin] += 1
-        hist /= self.n
-
-        #hist, _ = np.histogram(data, bins=bin_edges)
-
-        return hist, bin_edges
+        hists, bin_edges = calc_loghists([data], [self.n], power_min, power_max)
+        return hists[0], bin_edges
 
     def draw_loghists(self, ax_v, ax_vangle, filetitle_plot):
         self.draw_loghist(self.profiles['v'], ax_v, 'v ' + filetitle_plot, '#1f77b4')
@@ -200,54 +253,37 @@ class Data:
         ax.title.set_text(title)
 
     def classify_activity(self, output_type):
-        self.activity = {}
+        # classified once per output type
+        if output_type not in self.activities:
+            self.activities[output_type] = self.calc_activity(output_type)
+        self.activity, self.nactivity = self.activities[output_type]
+        return self.nactivity
+
+    def calc_activity(self, output_type):
+        if output_type not in ACTIVITY_TYPES:
+            raise ValueError(f'Unknown activity type: {output_type}')
+        activity_types = ACTIVITY_TYPES[output_type]
+        sources = [self.data['v_projection'], self.data['v_angle'],
+                   self.data['length_major1'], self.data['length_minor1']]
+        # frames paired by position, up to shortest source
+        n = min([len(self.frames)] + [len(source) for source in sources])
+        v, v_angle, lenl, lenw = [np.fromiter(source.values(), dtype=float, count=n) for source in sources]
+
+        v_norm = v / self.meanl
+        length_major_delta = abs(lenl - np.concatenate([[self.meanl], lenl[:-1]])) / self.meanl
+        length_minor_delta = abs(lenw - np.concatenate([[self.meanw], lenw[:-1]])) / self.meanw
+        v_angle_norm = abs(v_angle) / VANGLE_NORM
+
+        # index in activity types
         if output_type == 'movement_type':
-            self.nactivity = {'': 0, 'brownian': 0, 'levi': 0, 'ballistic': 0}
-        elif output_type == 'movement':
-            self.nactivity = {'': 0, 'appendages': 0, 'moving': 0}
+            levi = (v_norm > 0.6) & (v_angle_norm < 0.05)
+            codes = np.select([v_norm > 3, levi, abs(v_norm) > 0.6], [3, 2, 1], 0)
         else:
-            self.nactivity = {}
-
-        v_all = self.data['v_projection']
-        v_angle_all = self.data['v_angle']
-        length_major = self.data['length_major1']
-        length_minor = self.data['length_minor1']
-
-        lenl0 = self.meanl
-        lenw0 = self.meanw
-        for frame, v, v_angle, lenl, lenw in zip(self.frames, v_all.values(), v_angle_all.values(),
-                                                 length_major.values(), length_minor.values()):
-            v_norm = v / self.meanl
-            length_major_delta = abs(lenl - lenl0) / self.meanl
-            length_minor_delta = abs(lenw - lenw0) / self.meanw
-            v_angle_norm = abs(v_angle) / VANGLE_NORM
-
-            activity_type = ''
-            if output_type == 'movement_type':
-                if v_norm > 3:
-                    activity_type = 'ballistic'
-                elif abs(v_norm) > 0.6:
-                    if v_norm > 0.6 and v_angle_norm < 0.05:
-                        activity_type = 'levi'
-                    else:
-                        activity_type = 'brownian'
-                else:
-                    activity_type = ''
-
-            elif output_type == 'movement':
-                if v_norm > 0.2:
-                    activity_type = 'moving'
-                elif length_major_delta + length_minor_delta > 0.01:
-                    activity_type = 'appendages'
-                else:
-                    activity_type = ''
-
-            lenl0 = lenl
-            lenw0 = lenw
-
-            self.activity[frame] = activity_type
-            self.nactivity[activity_type] += 1
-        return self.nactivity
+            codes = np.select([v_norm > 0.2, length_major_delta + length_minor_delta > 0.01], [2, 1], 0)
+
+        activity = dict(zip(self.frames[:n], np.array(activity_types, dtype=object)[codes].tolist()))
+        nactivity = dict(zip(activity_types, np.bincount(codes, minlength=len(activity_types)).tolist()))
+        return activity, nactivity
 
     def get_activities_time(self):
         return {activity_type: self.get_activity_time(activity_type) for activity_type in self.nactivity}
@@ -264,26 +300,100 @@ class Data:
         return f'{self.original_title} {self.new_label}'
 
 
-def create_datas(filenames, fps=1, pixel_size=1, window_size='1s'):
+def calc_profiles(datas):
+    # profile histograms of all tracks, as one batched operation per profile; returns bin edges per profile
+    all_bin_edges = {}
+    datas = [data for data in datas if data.has_data]
+    for data in datas:
+        data.calc_profile_values()
+    for profile, (power_min, power_max) in PROFILE_POWER_RANGES.items():
+        hists, bin_edges = calc_loghists([data.profile_values[profile] for data in datas],
+                                         [data.n for data in datas], power_min, power_max)
+        for data, hist in zip(datas, hists):
+            data.profiles[profile] = hist, bin_edges
+        all_bin_edges[profile] = bin_edges
+    return all_bin_edges
+
+
+def calc_loghists(values_list, ns, power_min, power_max):
+    # assume symtric scale - middle bin is 10^0 = 1
+    bin_edges = np.logspace(power_min, power_max, PROFILE_HIST_BINS + 1)
+    if len(values_list) == 0:
+        return np.zeros((0, PROFILE_HIST_BINS)), bin_edges
+
+    # manual histogram, ensuring values at (positive) histogram edges are counted
+    values = np.concatenate([np.asarray(values, dtype=float).ravel() for values in values_list])
+    track_indices = np.repeat(np.arange(len(values_list)), [np.size(values) for values in values_list])
+    factor = (power_max - power_min) / PROFILE_HIST_BINS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bins = (np.log10(np.abs(values)) - power_min) / factor
+    # discard zero / low / missing values
+    selected = (values != 0) & (bins >= 0)
+    bins = np.clip(np.trunc(bins[selected]), 0, PROFILE_HIST_BINS - 1).astype(int)
+    counts = np.bincount(track_indices[selected] * PROFILE_HIST_BINS + bins,
+                         minlength=len(values_list) * PROFILE_HIST_BINS)
+    hists = counts.reshape(len(values_list), PROFILE_HIST_BINS) / np.asarray(ns, dtype=float).reshape(-1, 1)
+    return hists, bin_edges
+
+
+def create_datas(filenames, fps=1, pixel_size=1, window_size='1s', window_method='fast', window_sizes=None, workers=1,
+                 pool=None):
+    # files are imported in parallel processes (workers: None: all cores; pool: existing process pool to reuse)
     all_data = []
-    for filename in tqdm(filenames):
-        data = import_file(filename)
-        for id, data1 in data.items():
-            all_data.append(Data(data=data1, filename=filename, id=id,
-                                 fps=fps, pixel_size=pixel_size, window_size=window_size))
+    all_arrays = parallel_map(import_file_arrays, filenames, workers, progress=True, pool=pool)
+    for filename, arrays in zip(filenames, all_arrays):
+        for id, data1 in arrays.items():
+            all_data.append(Data(data=arrays_to_data(data1), filename=filename, id=id,
+                                 fps=fps, pixel_size=pixel_size, window_size=window_size,
+                                 window_method=window_method, window_sizes=window_sizes))
     return all_data
 
 
 def read_data(filename, fps=1, pixel_size=1, window_size='1s'):
-    data = import_file(filename)
-    id = next(iter(data.keys()))
-    data_dict = {id: Data(data=data[id], filename=filename, id=id,
-                          fps=fps, pixel_size=pixel_size, window_size=window_size)}
-    return data_dict
+    return read_datas([filename], fps=fps, pixel_size=pixel_size, window_size=window_size)[0]
+
+
+def read_datas(filenames, fps=1, pixel_size=1, window_size='1s', workers=1):
+    # first track of each file
+    data_dicts = []
+    all_arrays = parallel_map(import_file_arrays, filenames, workers)
+    for filename, arrays in zip(filenames, all_arrays):
+        id = next(iter(arrays.keys()))
+        data_dicts.append({id: Data(data=arrays_to_data(arrays[id]), filename=filename, id=id,
+                                    fps=fps, pixel_size=pixel_size, window_size=window_size)})
+    return data_dicts
+
+
+def import_file_arrays(filename):
+    # compact for transfer between processes: frames and values per column, as arrays where possible
+    return {id: {column: (values_to_array(list(values.keys())), values_to_array(list(values.values())))
+                 for column, values in data.items()}
+            for id, data in import_file(filename).items()}
+
+
+def values_to_array(values):
+    try:
+        array = np.array(values)
+    except ValueError:
+        return values
+    if array.ndim == 1 and array.dtype.kind in 'biuf':
+        return array
+    return values
+
+
+def arrays_to_data(arrays):
+    return {column: dict(zip(values_to_list(frames), values_to_list(values)))
+            for column, (frames, values) in arrays.items()}
+
+
+def values_to_list(values):
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+    return values
 
 
 def write_datas(output_folder, datas):
     for data in datas:
         filetitle = os.path.basename(data.filetitle) + '.csv'
         filename = os.path.join(output_folder, filetitle)
-        export_csv(filename, {data.id: data.data})
+        export_csv(filename, {data.id: data.get_export_data()})
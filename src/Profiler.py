@@ -0,0 +1,95 @@
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class Profiler:
+    # stage timing: lap(stage) adds the time since the previous lap to the stage
+    # report per interval of frames as json line; all methods do nothing when disabled
+    # append: continue existing report file (resumed)
+    def __init__(self, enabled=False, filename=None, interval=1000, append=False):
+        self.enabled = enabled
+        self.filename = filename
+        self.interval = interval
+        self.file = None
+        if enabled and filename:
+            self.file = open(filename, 'a' if append else 'w')
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.window_start_time = self.start_time
+        self.nframes = 0
+        self.window_frames = 0
+        self.counts = {}
+        self.times = {}
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.window_start_time = self.start_time
+
+    def lap(self, stage):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0) + now - self.last_time
+        self.last_time = now
+
+    def end_frame(self, counts, gauges):
+        # counts: summed per report (rates); gauges: current values
+        if not self.enabled:
+            return
+        self.nframes += 1
+        self.window_frames += 1
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+        if self.window_frames >= self.interval:
+            self.report(gauges)
+
+    def report(self, gauges=None):
+        if not self.enabled or self.window_frames == 0:
+            return
+        now = time.perf_counter()
+        duration = now - self.window_start_time
+        report = {'time': round(now - self.start_time, 3), 'frames': self.nframes,
+                  'frames_per_s': round(self.window_frames / duration, 3) if duration > 0 else None}
+        for key, value in self.counts.items():
+            report[f'{key}_per_s'] = round(value / duration, 3) if duration > 0 else None
+        if gauges:
+            report |= gauges
+        report['stages'] = {stage: round(stage_time, 6) for stage, stage_time in self.times.items()}
+        report['peak_rss_mb'] = get_peak_rss()
+        line = json.dumps(report)
+        if self.file is not None:
+            self.file.write(line + '\n')
+            self.file.flush()
+        else:
+            print(line)
+        self.window_start_time = now
+        self.window_frames = 0
+        self.counts = {}
+        self.times = {}
+
+    def close(self, gauges=None):
+        self.report(gauges)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def get_peak_rss():
+    # peak resident memory of this process (MB)
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes instead of kilobytes
+        peak_rss /= 1024
+    return round(peak_rss / 1024, 3)
@@ -0,0 +1,121 @@
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+import time
+import traceback
+from importlib import import_module
+import yaml
+
+
+def run_operations(params):
+    for operation0 in params['operations']:
+        operation = next(iter(operation0))
+        try:
+            module = import_module(f'src.pipeline.{operation}')
+        except Exception as e:
+            raise FileNotFoundError(f'Unknown operation: {operation}\n{e}')
+        print(f'[Operation: {operation}]')
+        module.run(params, operation0[operation])
+
+
+def create_tasks(params_files, datasets=None):
+    # task for each combination of params file and dataset (base_dir override)
+    if datasets:
+        dataset_dirs = []
+        for dataset in datasets:
+            dataset_dirs.extend(sorted(glob.glob(dataset)) if glob.has_magic(dataset) else [dataset])
+    else:
+        dataset_dirs = [None]
+    tasks = []
+    for params_file in params_files:
+        for dataset_dir in dataset_dirs:
+            task_id = params_file if dataset_dir is None else f'{params_file}:{dataset_dir}'
+            tasks.append({'id': task_id, 'params': params_file, 'base_dir': dataset_dir})
+    return tasks
+
+
+def read_manifest(manifest):
+    # returns latest status per task id
+    status = {}
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    status[entry['task']] = entry['status']
+    return status
+
+
+def write_manifest(manifest, entry):
+    # single appended line per entry, shared between processes / nodes
+    with open(manifest, 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+
+
+def run_task(job):
+    task, manifest, resume, workers = job
+    start_time = time.time()
+    entry = {'task': task['id']}
+    try:
+        with open(task['params'], 'r') as file:
+            params = yaml.safe_load(file)
+        if task['base_dir'] is not None:
+            params['general']['base_dir'] = task['base_dir']
+        if resume:
+            params['general']['resume'] = True
+        if workers is not None:
+            # cores shared by parallel tasks, unless set in the parameters
+            params['general'].setdefault('workers', workers)
+        run_operations(params)
+        entry['status'] = 'done'
+    except Exception as e:
+        traceback.print_exc()
+        entry['status'] = 'failed'
+        entry['error'] = f'{type(e).__name__}: {e}'
+    entry['duration'] = round(time.time() - start_time, 3)
+    write_manifest(manifest, entry)
+    return entry
+
+
+def run_batch(tasks, manifest, workers=None, shard=None, nshards=1, resume=False):
+    # run tasks not completed according to manifest; shard: only run every nshards-th task from shard
+    if shard is not None:
+        tasks = tasks[shard::nshards]
+    status = read_manifest(manifest)
+    pending_tasks = [task for task in tasks if status.get(task['id']) != 'done']
+    print(f'Batch: {len(tasks) - len(pending_tasks)} of {len(tasks)} tasks completed before')
+    if workers == 1 or len(pending_tasks) <= 1:
+        entries = [run_task((task, manifest, resume, None)) for task in pending_tasks]
+    else:
+        # worker processes are not daemonic (unlike multiprocessing.Pool): tasks can start their own processes
+        nworkers = min(workers or os.cpu_count(), len(pending_tasks))
+        task_workers = max(os.cpu_count() // nworkers, 1)
+        jobs = [(task, manifest, resume, task_workers) for task in pending_tasks]
+        with ProcessPoolExecutor(nworkers) as executor:
+            entries = list(executor.map(run_task, jobs))
+    nfailed = len([entry for entry in entries if entry['status'] != 'done'])
+    print(f'Batch: {len(entries) - nfailed} tasks completed, {nfailed} failed')
+    return entries
+
+
+def create_slurm_script(filename, arguments, nshards, cpus_per_task=16, time_limit=480, memory='32G'):
+    # array job, each task runs its own shard of the batch
+    lines = [
+        '#!/usr/bin/env bash',
+        '#SBATCH --job-name=bio_b_batch',
+        '#SBATCH --part=ncpu',
+        f'#SBATCH --array=0-{nshards - 1}',
+        f'#SBATCH --cpus-per-task={cpus_per_task}',
+        f'#SBATCH --time={time_limit}',
+        f'#SBATCH --mem={memory}',
+        '',
+        'export PYTHONUNBUFFERED=TRUE',
+        'ml purge',
+        'ml Anaconda3',
+        'source /camp/apps/eb/software/Anaconda/conda.env.sh',
+        'conda activate bio-b-env',
+        f'python run.py {" ".join(arguments)} --shards={nshards} --shard=$SLURM_ARRAY_TASK_ID',
+    ]
+    with open(filename, 'w', newline='\n') as file:
+        file.write('\n'.join(lines) + '\n')
@@ -1,12 +1,21 @@
 import csv
+import os
 
 
 class CsvStreamWriter:
-    def __init__(self, filename, batch_size=1000):
+    def __init__(self, filename, batch_size=1000, resume=None):
         self.batch_size = batch_size
-        self.file = open(filename, 'w', newline='')
         self.writer = None
         self.data = []
+        if resume is not None and os.path.exists(filename):
+            # discard anything written after checkpoint
+            self.file = open(filename, 'r+', newline='')
+            self.file.seek(resume['offset'])
+            self.file.truncate()
+            if resume['column_names'] is not None:
+                self.writer = csv.DictWriter(self.file, fieldnames=resume['column_names'])
+        else:
+            self.file = open(filename, 'w', newline='')
 
     def write(self, data):
         self.data.append(data)
@@ -14,6 +23,12 @@ class CsvStreamWriter:
             self.write_batch()
             self.data = []
 
+    def write_columns(self, data):
+        # data: dict of equal length columns
+        keys = list(data.keys())
+        for values in zip(*data.values()):
+            self.write(dict(zip(keys, values)))
+
     def write_batch(self):
         if self.writer is None:
             column_names = list(self.data[0].keys())
@@ -21,6 +36,19 @@ class CsvStreamWriter:
             self.writer.writeheader()
         self.writer.writerows(self.data)
 
+    def get_pending_rows(self):
+        return len(self.data)
+
+    def checkpoint(self):
+        # write pending data to disk, returns state to resume from
+        if len(self.data) > 0:
+            self.write_batch()
+            self.data = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        column_names = self.writer.fieldnames if self.writer is not None else None
+        return {'offset': self.file.tell(), 'column_names': column_names}
+
     def close(self):
         if len(self.data) > 0:
             self.write_batch()
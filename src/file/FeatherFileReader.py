@@ -27,3 +27,11 @@ class FeatherFileReader:
                     batch = reader.get_batch(batchi)
                     for i in range(batch.num_rows):
                         yield {column_name: batch[column_name][i].as_py() for column_name in batch.column_names}
+
+    def get_batch_iterator(self, start=0):
+        # batches as columns of python values; start: number of batches to skip
+        for input_file in self.input_files:
+            with pyarrow.RecordBatchFileReader(input_file) as reader:
+                for batchi in range(min(start, reader.num_record_batches), reader.num_record_batches):
+                    yield reader.get_batch(batchi).to_pydict()
+                start = max(start - reader.num_record_batches, 0)
@@ -27,3 +27,13 @@ class FeatherStreamReader:
                 for batch in reader:
                     for i in range(batch.num_rows):
                         yield {column_name: batch[column_name][i].as_py() for column_name in batch.column_names}
+
+    def get_batch_iterator(self, start=0):
+        # batches as columns of python values; start: number of batches to skip
+        batchi = 0
+        for input_file in self.input_files:
+            with pyarrow.RecordBatchStreamReader(input_file) as reader:
+                for batch in reader:
+                    if batchi >= start:
+                        yield batch.to_pydict()
+                    batchi += 1
@@ -1,12 +1,17 @@
+import os
 import pyarrow
 
 
 class FeatherStreamWriter:
-    def __init__(self, filename, batch_size=1000):
+    def __init__(self, filename, batch_size=1000, resume=None):
         self.filename = filename
         self.batch_size = batch_size
+        self.file = None
         self.writer = None
+        self.nbatches = 0
         self.create_new_data()
+        if resume is not None:
+            self.resume(resume)
 
     def create_new_data(self):
         self.data = {}
@@ -21,14 +26,57 @@ class FeatherStreamWriter:
         if self.n >= self.batch_size:
             self.write_batch()
 
+    def write_columns(self, data):
+        # data: dict of equal length columns
+        nrows = 0
+        for key, values in data.items():
+            if key not in self.data:
+                self.data[key] = []
+            self.data[key].extend(values)
+            nrows = len(values)
+        self.n += nrows
+        if self.n >= self.batch_size:
+            self.write_batch()
+
     def write_batch(self):
-        batch = pyarrow.record_batch(self.data)
+        self.write_record_batch(pyarrow.record_batch(self.data))
+        self.create_new_data()
+
+    def write_record_batch(self, batch):
         if self.writer is None:
-            self.writer = pyarrow.RecordBatchStreamWriter(self.filename, batch.schema)
+            self.file = open(self.filename, 'wb')
+            self.writer = pyarrow.RecordBatchStreamWriter(self.file, batch.schema)
         self.writer.write_batch(batch)
-        self.create_new_data()
+        self.nbatches += 1
+
+    def get_pending_rows(self):
+        return self.n
+
+    def checkpoint(self):
+        # write pending data to disk, returns state to resume from
+        if self.n > 0:
+            self.write_batch()
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        return {'nbatches': self.nbatches}
+
+    def resume(self, state):
+        # keep batches written up to checkpoint, discard anything after
+        if state['nbatches'] == 0 or not os.path.exists(self.filename):
+            return
+        partial_filename = self.filename + '.partial'
+        os.replace(self.filename, partial_filename)
+        with open(partial_filename, 'rb') as file:
+            file.seek(0)
+            reader = pyarrow.ipc.open_stream(file)
+            for _ in range(state['nbatches']):
+                self.write_record_batch(reader.read_next_batch())
+        os.remove(partial_filename)
 
     def close(self):
         if self.n > 0:
             self.write_batch()
-        self.writer.close()
+        if self.writer is not None:
+            self.writer.close()
+            self.file.close()
@@ -1,4 +1,6 @@
 PROFILE_HIST_BINS = 20
+# log10 range of profile histograms
+PROFILE_POWER_RANGES = {'v': (-2, 2), 'vangle': (-3, 1)}
 VANGLE_NORM = 360
 
 PLOT_DPI = 300
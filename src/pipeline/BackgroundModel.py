@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class BackgroundModel:
+    def __init__(self, params):
+        # method: median (approximate running median) or mean (exponential running mean)
+        self.method = params.get('method', 'median')
+        # update_rate: mean: weight of new sample; median: step size per sample (intensity range 0-1)
+        self.update_rate = params.get('update_rate', 0.01)
+        # sample_interval: update the model every n-th processed frame
+        self.sample_interval = int(params.get('sample_interval', 1))
+        # precompute_samples: number of sparsely sampled frames used to initialise the model (0: disabled)
+        self.precompute_samples = int(params.get('precompute_samples', 0))
+        self.background = None
+        self.nsamples = 0
+        self.buffers = {}
+
+    def precompute(self, images):
+        # images: (preprocessed) sampled frames; exact median as starting point
+        self.background = np.median(np.stack(images), 0).astype(np.float32)
+        self.nsamples = len(images)
+
+    def check_update(self, frame_count):
+        return frame_count % self.sample_interval == 0
+
+    def init_background(self, image):
+        # first sample: (full) image
+        self.background = np.array(image, dtype=np.float32)
+        self.nsamples = 0
+
+    def update(self, image, region=None):
+        # region: part of the background covered by image (tiled processing); call end_update after all regions
+        # background needs to be initialised before updating regions
+        if self.background is None:
+            self.init_background(image)
+        background = self.background[region] if region is not None else self.background
+        if self.nsamples == 0:
+            background[...] = image
+        else:
+            buffer = self.buffers.get(image.shape)
+            if buffer is None:
+                buffer = np.empty(image.shape, dtype=np.float32)
+                self.buffers[image.shape] = buffer
+            np.subtract(image, background, out=buffer)
+            if self.method == 'mean':
+                # cumulative mean while the model is still young
+                rate = max(self.update_rate, 1 / (self.nsamples + 1))
+                buffer *= rate
+            else:
+                np.sign(buffer, out=buffer)
+                buffer *= self.update_rate
+            background += buffer
+        if region is None:
+            self.end_update()
+
+    def end_update(self):
+        self.nsamples += 1
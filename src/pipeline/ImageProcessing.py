@@ -3,9 +3,12 @@ import os
 import cv2 as cv
 import numpy as np
 
+from src.file.CsvStreamWriter import CsvStreamWriter
+from src.file.FeatherStreamWriter import FeatherStreamWriter
+from src.pipeline.BackgroundModel import BackgroundModel
 from src.segmentation import *
 from src.util import *
-from src.video import video_iterator, video_info
+from src.video import video_iterator, video_info, video_sample_iterator
 
 
 class ImageProcessing:
@@ -13,36 +16,129 @@ class ImageProcessing:
         self.input_files = input_files
         self.output = output
         self.video_output = video_output
-        _, _, _, fps = video_info(self.input_files[0])
+        _, _, nframes, fps = video_info(self.input_files[0])
         self.frame_start = get_frames_number(params.get('frame_start', 0), fps)
-        self.frame_end = get_frames_number(params.get('frame_end'), fps)
+        self.frame_end = get_frames_number(params.get('frame_end', nframes), fps)
         self.frame_interval = get_frames_number(params.get('frame_interval', 1), fps)
         self.operations = params.get('operations')
 
         if 'background' in params:
             self.background = float_image(grayscale_image(imread(os.path.join(base_dir, params['background']))))
+            self.background = self.background.astype(np.float32, copy=False)
         else:
             self.background = None
 
+        # background_model: adaptive background, estimated from (sampled) frames
+        if 'background_model' in params:
+            self.background_model = BackgroundModel(params['background_model'])
+        else:
+            self.background_model = None
+        self.framei = 0
+        self.frame_count = 0
+        self.data_writers = []
+
         if 'mask' in params:
             self.mask = float_image(grayscale_image(imread(os.path.join(base_dir, params['mask']))))
+            self.mask = self.mask.astype(np.float32, copy=False)
         else:
             self.mask = None
 
+        # buffered: reuse (float32) output buffers for each operation between frames
+        self.buffered = params.get('buffered', False)
+        self.buffers = {}
+
+        # texture_method: fft (default) or direct (filter2D per kernel)
+        self.texture_method = params.get('texture_method', 'fft')
+        # texture_scale: process texture at reduced scale (<1) when the wavelength allows
+        self.texture_scale = params.get('texture_scale', 1)
+        self.texture_tile_size = params.get('texture_tile_size', 512)
         self.texture_filters = []
+        self.texture_spectra = {}
+
+        # tile_size: process large frames in tiles (peak memory independent of frame size)
+        # tile_overlap: halo around each tile, should exceed object size plus filter radius
+        self.tile_size = params.get('tile_size')
+        self.tile_overlap = params.get('tile_overlap', 64)
+        self.region = None
+        self.core_region = None
+        self.tile_core = None
+        self.detection_count = 0
 
     def process_images(self, input_files=None):
         # TODO: support image sequence
         if input_files is None:
             input_files = self.input_files
-        for image in video_iterator(input_files,
-                                    start=self.frame_start, end=self.frame_end, interval=self.frame_interval):
-            self.process_image(image)
+        if self.background_model is not None and self.background_model.precompute_samples > 0:
+            self.precompute_background(input_files)
+        if self.output:
+            batch_size = 1000
+            self.data_writers = [
+                FeatherStreamWriter(self.output + '.feather', batch_size),
+                CsvStreamWriter(self.output + '.csv', batch_size),
+            ]
+        frames = range(self.frame_start, self.frame_end, self.frame_interval)
+        frame_iterator = video_iterator(input_files, start=self.frame_start, end=self.frame_end,
+                                        interval=self.frame_interval, reuse_frame=self.buffered)
+        for frame_count, (framei, image) in enumerate(zip(frames, frame_iterator)):
+            if image is not None:
+                self.framei = framei
+                self.frame_count = frame_count
+                self.process_image(image)
+        for data_writer in self.data_writers:
+            data_writer.close()
+        self.data_writers = []
+
+    def get_background_operations(self):
+        # operations preceding background subtraction
+        operations = self.operations
+        if 'subtract_background' in operations:
+            operations = operations[:operations.index('subtract_background')]
+        return operations
+
+    def precompute_background(self, input_files):
+        # apply operations preceding background subtraction to sparsely sampled frames
+        operations = self.get_background_operations()
+        images = []
+        for image in video_sample_iterator(input_files, self.background_model.precompute_samples,
+                                           start=self.frame_start, end=self.frame_end):
+            images.append(np.array(self.process_operations(image, operations), dtype=np.float32))
+        self.background_model.precompute(images)
 
     def process_image(self, image):
-        image = float_image(image)
+        self.detection_count = 0
+        if not self.tile_size:
+            return self.process_operations(image)
+
+        height, width = image.shape[:2]
+        background_update = self.background_model is not None and \
+            self.background_model.check_update(self.frame_count)
+        if background_update and self.background_model.background is None:
+            # initialise from full frame, halos of tiles are compared with parts not processed yet
+            background_image = self.process_operations(image, self.get_background_operations())
+            self.background_model.init_background(background_image)
+        for y0 in range(0, height, self.tile_size):
+            for x0 in range(0, width, self.tile_size):
+                y1, x1 = min(y0 + self.tile_size, height), min(x0 + self.tile_size, width)
+                hy0, hx0 = max(y0 - self.tile_overlap, 0), max(x0 - self.tile_overlap, 0)
+                hy1, hx1 = min(y1 + self.tile_overlap, height), min(x1 + self.tile_overlap, width)
+                # region: tile including halo; core: part of the frame this tile is responsible for
+                self.region = (slice(hy0, hy1), slice(hx0, hx1))
+                self.core_region = (slice(y0, y1), slice(x0, x1))
+                self.tile_core = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+                self.process_operations(image[self.region])
+        self.region = None
+        self.core_region = None
+        self.tile_core = None
+        if background_update:
+            self.background_model.end_update()
+        return None
+
+    def process_operations(self, image, operations=None):
+        if operations is None:
+            operations = self.operations
+        image = self.call_buffered('float_image', float_image, image)
         original_image = image
-        for operation0 in self.operations:
+        for operationi, operation0 in enumerate(operations):
             operation = operation0.rstrip(')').split('(')
             params = []
             if len(operation) > 1:
@@ -67,34 +163,88 @@ class ImageProcessing:
             for param in sig.parameters.values():
                 if param.name == 'original_image':
                     params.append(original_image)
-            image = function(image, *params)
-
-        pass
-
-    def subtract_background(self, image):
-        return np.abs(image - self.background)
-
-    def apply_mask(self, image):
-        return image * self.mask
-
-    def init_texture_detection(self):
-        # This function is designed to produce a set of GaborFilters
-        # an even distribution of theta values equally distributed amongst pi rad / 180 degree
-        filters = []
-        num_filters = 16
-        ksize = 35  # The local area to evaluate
-        sigma = 3.0  # Larger Values produce more edges
-        lambd = 10.0
-        gamma = 0.5
-        psi = 0  # Offset value - lower generates cleaner results
-        for theta in np.arange(0, np.pi, np.pi / num_filters):  # Theta is the orientation for edge detection
-            kern = cv.getGaborKernel((ksize, ksize), sigma, theta, lambd, gamma, psi, ktype=cv.CV_64F)
-            kern /= 1.0 * kern.sum()  # Brightness normalization
-            filters.append(kern)
-        self.texture_filters = filters
+            if 'dst' in sig.parameters:
+                image = self.call_buffered(operationi, function, image, *params)
+            else:
+                image = function(image, *params)
+        return image
+
+    def call_buffered(self, key, function, image, *params):
+        # output shape only depends on the operation and input shape
+        if not self.buffered:
+            return function(image, *params)
+        buffer_key = (key, image.shape)
+        result = function(image, *params, dst=self.buffers.get(buffer_key))
+        if result is not image:
+            self.buffers[buffer_key] = result
+        return result
+
+    def subtract_background(self, image, dst=None):
+        background = self.background
+        if self.background_model is not None:
+            if self.background_model.check_update(self.frame_count):
+                if self.tile_core is not None:
+                    # update tile cores only; halos overlap
+                    self.background_model.update(image[self.tile_core], self.core_region)
+                else:
+                    self.background_model.update(image)
+            background = self.background_model.background
+        if self.region is not None:
+            background = background[self.region]
+        dst = np.subtract(image, background, out=dst)
+        return np.abs(dst, out=dst)
+
+    def apply_mask(self, image, dst=None):
+        mask = self.mask
+        if self.region is not None:
+            mask = mask[self.region]
+        return np.multiply(image, mask, out=dst)
+
+    def detect(self, image, min_area=1):
+        # write detections of binary image in tracking input format
+        detections = detect_components(image, min_area)
+        if self.tile_core is not None:
+            # keep detections centred in tile core, convert to frame coordinates
+            y_core, x_core = self.tile_core
+            selected = ((detections['x_body'] >= x_core.start) & (detections['x_body'] < x_core.stop) &
+                        (detections['y_body'] >= y_core.start) & (detections['y_body'] < y_core.stop))
+            y_offset, x_offset = self.region[0].start, self.region[1].start
+            for key, values in detections.items():
+                values = values[selected]
+                if key.startswith('x'):
+                    values = values + x_offset
+                elif key.startswith('y'):
+                    values = values + y_offset
+                detections[key] = values
+        ndetections = len(detections['id'])
+        detections['id'] = self.detection_count + np.arange(ndetections)
+        self.detection_count += ndetections
+        if ndetections > 0:
+            columns = {'frame': [self.framei] * ndetections}
+            columns |= {key: values.tolist() for key, values in detections.items()}
+            for data_writer in self.data_writers:
+                data_writer.write_columns(columns)
+        return image
+
+    def init_texture_detection(self, scale=1):
+        self.texture_filters = create_gabor_filters(scale)
+        self.texture_spectra = {}
 
     def texture_detection(self, image):
         if not self.texture_filters:
-            self.init_texture_detection()
+            self.init_texture_detection(self.texture_scale)
         # apply gabor filer and edge detection
-        return edge_detection(gabor_filtering(image, self.texture_filters))
+        return edge_detection(self.gabor_filtering(image))
+
+    def gabor_filtering(self, image):
+        if self.texture_scale != 1:
+            height, width = image.shape[:2]
+            image = cv.resize(image, None, fx=self.texture_scale, fy=self.texture_scale, interpolation=cv.INTER_AREA)
+        if self.texture_method == 'fft':
+            filtered_image = gabor_filtering_fft(image, self.texture_filters, self.texture_tile_size,
+                                                 kernel_spectra=self.texture_spectra)
+        else:
+            filtered_image = gabor_filtering(image, self.texture_filters)
+        if self.texture_scale != 1:
+            filtered_image = cv.resize(filtered_image, (width, height), interpolation=cv.INTER_LINEAR)
+        return filtered_image
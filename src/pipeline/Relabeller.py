@@ -10,8 +10,9 @@ from src.util import get_bio_base_name, numeric_string_sort, calc_dist, calc_mea
 
 
 class Relabeller():
-    def __init__(self, params, annotation_filename=''):
+    def __init__(self, params, annotation_filename='', workers=1):
         self.method = params['method']
+        self.workers = workers
         self.input_pixel_size = params.get('input_pixel_size', 1)
         self.max_relabel_match_distance = params.get('max_relabel_match_distance', 0)
         if annotation_filename != '':
@@ -33,7 +34,7 @@ class Relabeller():
 
     def relabel_sort(self, data_files, tracks_relabel_dir, video_info):
         sort_key = self.method.split()[-1]
-        datas = create_datas(data_files)
+        datas = create_datas(data_files, workers=self.workers)
         values = [data.get_mean_feature(sort_key) for data in datas]
         datas = [data for value, data in sorted(zip(values, datas), reverse=True)]
         for new_label0, data in enumerate(datas):
@@ -41,12 +42,12 @@ class Relabeller():
             data.set_new_label(new_label)
             filename, extension = os.path.splitext(os.path.basename(data.filename))
             new_filename = os.path.join(tracks_relabel_dir, filename.rsplit('_', 1)[0] + '_' + new_label + extension)
-            export_csv(new_filename, {new_label: data.data})
+            export_csv(new_filename, {new_label: data.get_export_data()})
 
     def relabel_annotation(self, data_files, tracks_relabel_dir, video_info):
         # Reading labels & find nearest
         datas = []
-        datas0 = create_datas(data_files)
+        datas0 = create_datas(data_files, workers=self.workers)
         for data in datas0:
             data.calc_means()
             best_label, best_dist = self.get_near_label(data)
@@ -114,7 +115,7 @@ class Relabeller():
     def relabel_gt(self, data_files, tracks_relabel_dir, video_info):
         final_matches = {}
         matches = {}
-        datas = create_datas(data_files)
+        datas = create_datas(data_files, workers=self.workers)
         data_dict = {data.id: data for data in datas}
         available_tracks = list(data_dict)
         position_factor = 1 / self.input_pixel_size
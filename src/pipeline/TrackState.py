@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class TrackState:
+    # array-backed track state, one slot per track; slots of removed tracks are reused
+    def __init__(self, capacity=64):
+        self.ids = np.full(capacity, -1)
+        self.positions = np.zeros((capacity, 2))
+        self.deltas = np.zeros((capacity, 2))
+        self.active_counts = np.zeros(capacity, dtype=int)
+        self.inactive_counts = np.zeros(capacity, dtype=int)
+        self.last_active = np.zeros(capacity, dtype=int)
+        self.mean_lengths = np.zeros(capacity)
+        self.lengths = np.full(capacity, np.nan)
+        self.assigned = np.zeros(capacity, dtype=bool)
+        # values: original values of the last assigned detection
+        self.values = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        # slots: slots in use, in order of track id
+        self.slots = np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def items(self):
+        return zip(self.ids[self.slots].tolist(), self.slots.tolist())
+
+    def grow(self):
+        capacity = len(self.ids)
+        for name in ['ids', 'positions', 'deltas', 'active_counts', 'inactive_counts', 'last_active',
+                     'mean_lengths', 'lengths', 'assigned']:
+            array = getattr(self, name)
+            new_array = np.zeros((capacity * 2,) + array.shape[1:], dtype=array.dtype)
+            new_array[:capacity] = array
+            setattr(self, name, new_array)
+        self.ids[capacity:] = -1
+        self.lengths[capacity:] = np.nan
+        self.values.extend([None] * capacity)
+        self.free_slots.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def add(self, track_id, position, length, values, framei):
+        # track ids are expected in increasing order
+        if not self.free_slots:
+            self.grow()
+        slot = self.free_slots.pop()
+        self.ids[slot] = track_id
+        self.positions[slot] = position
+        self.deltas[slot] = 0
+        self.active_counts[slot] = 0
+        self.inactive_counts[slot] = 0
+        self.last_active[slot] = framei
+        self.mean_lengths[slot] = length
+        self.lengths[slot] = length
+        self.assigned[slot] = True
+        self.values[slot] = values
+        self.slots = np.append(self.slots, slot)
+        return slot
+
+    def remove(self, slots):
+        for slot in slots:
+            self.ids[slot] = -1
+            self.values[slot] = None
+            self.free_slots.append(slot)
+        self.slots = self.slots[~np.isin(self.slots, slots)]
+
+    def predict(self, move_distance):
+        # move unassigned tracks along their (damped) motion, step limited to move_distance
+        slots = self.slots[~self.assigned[self.slots]]
+        self.inactive_counts[slots] += 1
+        deltas = self.deltas[slots]
+        lengths = np.sqrt(np.sum(deltas * deltas, 1))
+        clamped = lengths > move_distance
+        angles = np.arctan2(deltas[clamped, 1], deltas[clamped, 0])
+        deltas[clamped] = move_distance * np.stack([np.cos(angles), np.sin(angles)], 1)
+        deltas[~clamped] *= 0.95
+        self.deltas[slots] = deltas
+        self.positions[slots] += deltas
+        self.assigned[self.slots] = False
+
+    def expire(self, framei, max_inactive):
+        # remove tracks not assigned for max_inactive frames (0: never); returns number of removed tracks
+        if not max_inactive:
+            return 0
+        expired = self.slots[framei - self.last_active[self.slots] >= max_inactive]
+        self.remove(expired)
+        return len(expired)
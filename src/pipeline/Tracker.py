@@ -1,5 +1,13 @@
+import json
+import os
+import pickle
 import numpy as np
-from sklearn.metrics import euclidean_distances, pairwise_distances
+import pyarrow
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from sklearn.metrics import pairwise_distances
 from tqdm import tqdm
 
 from src.file.FeatherFileReader import FeatherFileReader
@@ -7,6 +15,9 @@ from src.file.FeatherFileWriter import FeatherFileWriter
 from src.file.FeatherStreamReader import FeatherStreamReader
 from src.file.CsvStreamWriter import CsvStreamWriter
 from src.file.FeatherStreamWriter import FeatherStreamWriter
+from src.pipeline.TrackingStats import TrackingStats
+from src.pipeline.TrackState import TrackState
+from src.Profiler import Profiler
 from src.util import *
 from src.video import video_iterator, draw_annotation, video_info
 
@@ -19,54 +30,127 @@ class Tracker:
         self.output = output
         self.video_output = video_output
         self.debug_mode = debug_mode
-        _, _, nframes, fps = video_info(self.video_input[0])
+        if self.video_input:
+            _, _, nframes, fps = video_info(self.video_input[0])
+        elif video_output:
+            raise ValueError('Video output requires video input')
+        elif 'frame_end' not in params:
+            raise ValueError('Missing video input (or frame_end)')
+        else:
+            # frame values used as frame numbers
+            nframes, fps = 0, 1
         self.frame_interval = get_frames_number(params.get('frame_interval', 1), fps)
         self.frame_start = get_frames_number(params.get('frame_start', 0), fps)
         self.frame_end = get_frames_number(params.get('frame_end', nframes), fps)
         self.operations = params.get('operations')
 
         self.id_label = params.get('id_label', 'id')
+        # keypoints: ordered along the body, columns x_<keypoint>, y_<keypoint>; the middle keypoint is tracked
+        self.keypoints = params.get('keypoints', ['head', 'body', 'tail'])
         self.max_individuals = params.get('max_individuals')
         self.move_distance = params.get('move_distance', 1)
         self.max_move_distance = params.get('max_move_distance', 1)
         self.min_active = params.get('min_active', 0)
         self.max_inactive = params.get('max_inactive', 0)
-        self.tracks = {}
+        # assignment: greedy (closest pairs first) or optimal (minimal total distance within gates)
+        self.assignment = params.get('assignment', 'greedy')
+        # spatial_index: only consider track-id pairs within the gate radius (large populations)
+        self.spatial_index = params.get('spatial_index', False)
+        # checkpoint_interval: save state for resuming every n (video) frames (requires output)
+        self.checkpoint_interval = get_frames_number(params.get('checkpoint_interval', 0), fps)
+        # chunks: track frame range as overlapping chunks in parallel, identities stitched in the overlaps
+        self.chunks = params.get('chunks', 1)
+        self.chunk_overlap = get_frames_number(params.get('chunk_overlap', 100), fps)
+        # chunk_index: only track this chunk (multiple nodes), run without to stitch finished chunks
+        self.chunk_index = params.get('chunk_index')
+        self.workers = params.get('workers')
+        # profile: report stage timing, rates and memory every profile_interval frames
+        self.profile = params.get('profile', False)
+        self.profile_interval = params.get('profile_interval', 1000)
+        # debug mode: summary of match distances, gating, births and deaths every debug_interval frames
+        # debug_sample_rate: fraction of matches written as separate rows
+        self.debug_interval = params.get('debug_interval', 1000)
+        self.debug_sample_rate = params.get('debug_sample_rate', 0)
+        self.debug_stats = None
+        self.debug_writer = None
+        self.debug_random = np.random.default_rng(0)
+        self.params = params
+        self.tracks = TrackState()
         self.next_id = 0
 
-    def track(self, input_files=None):
-        # for each unique frame, collect all ids+values into single dictionary[id] = values
+    def track(self, input_files=None, resume=False):
+        # for each unique frame, collect all detections of the frame into columns
         # assume that order of the data is: frames, ids
         if input_files is None:
             input_files = self.input_files
+        checkpoint_filename = self.output + '_checkpoint.pkl' if self.output else None
+        checkpoint = None
+        if checkpoint_filename and os.path.exists(checkpoint_filename):
+            if resume:
+                with open(checkpoint_filename, 'rb') as file:
+                    checkpoint = pickle.load(file)
+                if checkpoint['done']:
+                    print('Tracking already completed')
+                    return
+                print(f'Resuming after frame {checkpoint["framei"]}')
+            else:
+                os.remove(checkpoint_filename)
+        if checkpoint is not None:
+            self.tracks = checkpoint['tracks']
+            self.next_id = checkpoint['next_id']
+            frame_start = checkpoint['framei'] + self.frame_interval
+            start_batch = checkpoint['batchi']
+            writer_states = checkpoint['writers']
+            video_part = checkpoint['video_part'] + 1
+        else:
+            frame_start = self.frame_start
+            start_batch = 0
+            writer_states = {}
+            video_part = 0
+
         try:
             data_reader = FeatherStreamReader(input_files)
         except Exception as e:
             print(f'Warning: unable to open input files as stream ({e})')
             data_reader = FeatherFileReader(input_files)
-        data_iterator = data_reader.get_stream_iterator()
+        if start_batch is not None:
+            data_iterator = frame_columns_iterator(data_reader.get_batch_iterator(start_batch), start_batch=start_batch)
+        else:
+            data_iterator = iter([])
         if self.video_input:
             frame_iterator = video_iterator(self.video_input,
-                                            start=self.frame_start, end=self.frame_end, interval=self.frame_interval)
+                                            start=frame_start, end=self.frame_end, interval=self.frame_interval)
         else:
             frame_iterator = iter([])
 
         if self.output:
             batch_size = 1000
-            data_writers = [
-                FeatherStreamWriter(self.output + '_stream.feather', batch_size),
-                FeatherFileWriter(self.output + '.feather', batch_size),
-                CsvStreamWriter(self.output + '.csv', batch_size),
-            ]
+            data_writers = {
+                'stream': FeatherStreamWriter(self.output + '_stream.feather', batch_size,
+                                              resume=writer_states.get('stream')),
+                'file': FeatherFileWriter(self.output + '.feather', batch_size, resume=writer_states.get('file')),
+                'csv': CsvStreamWriter(self.output + '.csv', batch_size, resume=writer_states.get('csv')),
+            }
             if self.debug_mode:
-                self.debug_writer = CsvStreamWriter(self.output + '_debug.csv')
+                histogram_edges = np.linspace(0, self.max_move_distance, 11)
+                self.debug_stats = TrackingStats(self.output + '_debug_summary.jsonl', self.debug_interval,
+                                                 histogram_edges, append=checkpoint is not None)
+                if self.debug_sample_rate > 0:
+                    self.debug_writer = CsvStreamWriter(self.output + '_debug.csv', resume=writer_states.get('debug'))
+                    data_writers['debug'] = self.debug_writer
         else:
-            data_writers = []
+            data_writers = {}
+        output_writers = [data_writer for key, data_writer in data_writers.items() if key != 'debug']
 
         if self.video_output:
             width, height, nframes, fps = video_info(self.video_input[0])
             fourcc = cv.VideoWriter.fourcc(*'avc1')
-            vidwriter = cv.VideoWriter(self.video_output, fourcc, fps, (width, height))
+            video_output = self.video_output
+            if video_part > 0:
+                # resumed: continue in new video file
+                base, ext = os.path.splitext(video_output)
+                video_output = f'{base}_part{video_part}{ext}'
+            vidwriter = cv.VideoWriter(video_output, fourcc, fps, (width, height))
             label_color = color_float_to_cv((0, 0, 1))
             inactive_color = color_float_to_cv((0.5, 0.5, 1))
         else:
@@ -75,188 +159,479 @@ class Tracker:
             label_color = None
             inactive_color = None
 
-        frames = range(self.frame_start, self.frame_end, self.frame_interval)
-        data = {'frame': -1, 'values': {}}
-        for framei in tqdm(frames, total=len(frames)):
-            if self.video_output:
-                if self.video_input:
-                    image = next(frame_iterator)
+        profile_filename = self.output + '_profile.jsonl' if self.output else None
+        profiler = Profiler(self.profile, profile_filename, self.profile_interval, append=checkpoint is not None)
+        frames = range(frame_start, self.frame_end, self.frame_interval)
+        data = next(data_iterator, None)
+        profiler.start()
+        try:
+            for framei in tqdm(frames, total=len(frames)):
+                profiler.lap('other')
+                if self.video_output:
+                    if self.video_input:
+                        image = next(frame_iterator)
+                    else:
+                        image = np.zeros((height, width, 3), np.uint8)
                 else:
-                    image = np.zeros((height, width, 3), np.uint8)
-            else:
-                image = None
-            frame_done = False
-            frame_values = {}
-            while not frame_done:
-                data_framei = int(data['frame'])
-                if data_framei == framei:
-                    track_id = int(data[self.id_label])
-                    frame_values[track_id] = self.calc_features(data)
-                    frame_values[track_id]['original_values'] = data
-                elif data_framei > framei:
-                    frame_done = True
-                if not frame_done:
-                    try:
-                        data = next(data_iterator)
-                    except StopIteration:
-                        frame_done = True
-
-            self.track_frame(framei, frame_values)
-            if self.output:
-                for track_id, track in self.tracks.items():
-                    if track['assigned']:
-                        values = track['original_values']
-                        values['track_id'] = track_id
-                        for data_writer in data_writers:
-                            data_writer.write(values)
-            if self.video_output:
-                for track_id, track in self.tracks.items():
-                    if track['assigned'] or self.debug_mode:
-                        if track['assigned']:
-                            color = label_color
-                        else:
-                            color = inactive_color
-                        draw_annotation(image, str(track_id), track['position'], color=color)
-                vidwriter.write(image)
+                    image = None
+                profiler.lap('video_decode')
+                while data is not None and data[0] < framei:
+                    data = next(data_iterator, None)
+                if data is not None and data[0] == framei:
+                    columns = data[1]
+                    data = next(data_iterator, None)
+                else:
+                    columns = {}
+                profiler.lap('read')
+                detections = self.calc_frame_features(columns)
+                profiler.lap('features')
 
-        if self.output:
-            for data_writer in data_writers:
+                self.track_frame(framei, detections)
+                profiler.lap('track')
+                if self.output:
+                    for track_id, slot in self.tracks.items():
+                        if self.tracks.assigned[slot]:
+                            values = self.tracks.values[slot]
+                            values['track_id'] = track_id
+                            for data_writer in output_writers:
+                                data_writer.write(values)
+                profiler.lap('write')
+                if self.video_output:
+                    for track_id, slot in self.tracks.items():
+                        if self.tracks.assigned[slot] or self.debug_mode:
+                            if self.tracks.assigned[slot]:
+                                color = label_color
+                            else:
+                                color = inactive_color
+                            draw_annotation(image, str(track_id), self.tracks.positions[slot], color=color)
+                    profiler.lap('draw')
+                    vidwriter.write(image)
+                    profiler.lap('video_encode')
+
+                # checkpoint when the next frame starts a new interval (in video frames)
+                if checkpoint_filename and self.checkpoint_interval and \
+                        (framei - self.frame_start) // self.checkpoint_interval != \
+                        (framei + self.frame_interval - self.frame_start) // self.checkpoint_interval:
+                    # data: first unprocessed frame
+                    batchi = data[2] if data is not None else None
+                    self.save_checkpoint(checkpoint_filename, framei, batchi, data_writers, video_part)
+                    profiler.lap('checkpoint')
+                if self.profile:
+                    profiler.end_frame({'detections': len(detections['ids'])}, self.get_profile_gauges(data_writers))
+        finally:
+            profiler.close(self.get_profile_gauges(data_writers) if self.profile else None)
+            if self.debug_stats is not None:
+                self.debug_stats.close()
+                self.debug_stats = None
+            for data_writer in data_writers.values():
                 data_writer.close()
-            if self.debug_mode:
-                self.debug_writer.close()
+            if self.video_output:
+                vidwriter.release()
 
+        if checkpoint_filename and self.checkpoint_interval:
+            self.save_checkpoint(checkpoint_filename, self.frame_end, None, {}, video_part, done=True)
+
+    def get_profile_gauges(self, data_writers):
+        # queued_rows: rows buffered in writers, not yet written to file
+        return {'active_tracks': len(self.tracks),
+                'queued_rows': {key: data_writer.get_pending_rows() for key, data_writer in data_writers.items()}}
+
+    def save_checkpoint(self, filename, framei, batchi, data_writers, video_part, done=False):
+        # state after processing framei; batchi: input batch containing the next frame
+        checkpoint = {'done': done, 'framei': framei, 'batchi': batchi, 'video_part': video_part,
+                      'tracks': self.tracks, 'next_id': self.next_id,
+                      'writers': {key: data_writer.checkpoint() for key, data_writer in data_writers.items()}}
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as file:
+            pickle.dump(checkpoint, file)
+        os.replace(temp_filename, filename)
+
+    def track_chunks(self, input_files=None):
+        if input_files is None:
+            input_files = self.input_files
+        if not self.output:
+            raise ValueError('Chunk tracking requires output')
         if self.video_output:
-            vidwriter.release()
-
-    def calc_features(self, values0):
-        positions = []
-        positions.append((values0['x_head'], values0['y_head']))
-        positions.append((values0['x_body'], values0['y_body']))
-        positions.append((values0['x_tail'], values0['y_tail']))
-        values = {'positions': positions}
-        posi = int((len(positions) - 1) / 2)    # find the middle position
-        values['position'] = positions[posi]
-        last_position = None
-        dists = []
-        for position1 in positions:
-            if not position1 == (None, None):
-                if last_position is not None:
-                    dists.append(math.dist(last_position, position1))
-                last_position = position1
-        values['length'] = np.sum(dists)
-        return values
-
-    def track_frame(self, framei, ids):
+            print('Warning: video output not supported for chunk tracking')
+        chunk_ranges = calc_chunk_ranges(self.frame_start, self.frame_end, self.frame_interval,
+                                         self.chunks, self.chunk_overlap)
+        chunk_outputs = [f'{self.output}_chunk{chunki}' for chunki in range(len(chunk_ranges))]
+        # chunk info saved with chunk output: tracking params, chunk count and range
+        chunk_infos = [{'params': self.params, 'chunks': len(chunk_ranges), 'chunk_range': list(chunk_range),
+                        'input_files': list(input_files)} for chunk_range in chunk_ranges]
+        if self.chunk_index is not None:
+            chunk_indices = [self.chunk_index]
+        else:
+            # skip chunks already tracked with the same info
+            chunk_indices = [chunki for chunki, chunk_output in enumerate(chunk_outputs)
+                             if not chunk_complete(chunk_output, chunk_infos[chunki])]
+        jobs = []
+        for chunki in chunk_indices:
+            frame_start, _, frame_end = chunk_ranges[chunki]
+            params = self.params | {'frame_start': frame_start, 'frame_end': frame_end,
+                                    'chunks': 1, 'checkpoint_interval': 0}
+            jobs.append((params, self.base_dir, input_files, self.video_input, chunk_outputs[chunki],
+                         chunk_infos[chunki]))
+        parallel_map(track_chunk, jobs, self.workers)
+        if self.chunk_index is None:
+            self.stitch_chunks(chunk_ranges, chunk_outputs)
+
+    def stitch_chunks(self, chunk_ranges, chunk_outputs):
+        # link chunk tracks to tracks of the previous chunk sharing positions in the overlap, assign global ids
+        batch_size = 1000
+        data_writers = [
+            FeatherStreamWriter(self.output + '_stream.feather', batch_size),
+            FeatherFileWriter(self.output + '.feather', batch_size),
+            CsvStreamWriter(self.output + '.csv', batch_size),
+        ]
+        position_index = (len(self.keypoints) - 1) // 2
+        position_labels = [f'{coord}_{self.keypoints[position_index]}' for coord in ['x', 'y']]
+        next_id = 0
+        overlap_ids = {}
+        for chunki, ((frame_start, own_start, frame_end), chunk_output) in enumerate(zip(chunk_ranges, chunk_outputs)):
+            if not os.path.exists(chunk_output + '.feather'):
+                # no tracks in chunk
+                overlap_ids = {}
+                continue
+            with pyarrow.ipc.open_file(chunk_output + '.feather') as reader:
+                columns = reader.read_all().to_pydict()
+            frames = np.array(columns['frame'])
+            track_ids = np.array(columns['track_id'])
+            keys = list(zip(columns['frame'], *[columns[label] for label in position_labels]))
+            # match overlap: count shared positions for each pair of previous/current track
+            overlap = np.flatnonzero(frames < own_start)
+            pairs = [(overlap_ids[keys[index]], track_ids[index]) for index in overlap if keys[index] in overlap_ids]
+            id_map = {}
+            if pairs:
+                (previous_ids, current_ids), counts = np.unique(np.array(pairs).T, axis=1, return_counts=True)
+                unique_previous_ids, previous_indices = np.unique(previous_ids, return_inverse=True)
+                unique_current_ids, current_indices = np.unique(current_ids, return_inverse=True)
+                scores = np.zeros((len(unique_previous_ids), len(unique_current_ids)))
+                scores[previous_indices, current_indices] = counts
+                for previous_index, current_index in zip(*linear_sum_assignment(scores, maximize=True)):
+                    if scores[previous_index, current_index] > 0:
+                        id_map[unique_current_ids[current_index]] = unique_previous_ids[previous_index]
+            # new global ids in order of appearance
+            owned = np.flatnonzero(frames >= own_start) if chunki > 0 else np.arange(len(frames))
+            for track_id in track_ids[owned]:
+                if track_id not in id_map and \
+                        (self.max_individuals is None or next_id < self.max_individuals):
+                    id_map[track_id] = next_id
+                    next_id += 1
+            selected = [index for index in owned if track_ids[index] in id_map]
+            output_columns = {name: [values[index] for index in selected] for name, values in columns.items()}
+            output_columns['track_id'] = [int(id_map[track_ids[index]]) for index in selected]
+            if selected:
+                for data_writer in data_writers:
+                    data_writer.write_columns(output_columns)
+            # positions in the overlap of the next chunk
+            if chunki + 1 < len(chunk_ranges):
+                next_start = chunk_ranges[chunki + 1][0]
+                overlap_ids = {keys[index]: id_map[track_ids[index]]
+                               for index in np.flatnonzero(frames >= next_start) if track_ids[index] in id_map}
+        for data_writer in data_writers:
+            data_writer.close()
+
+    def calc_frame_features(self, columns):
+        # columns: values of all detections in a frame, as lists per column name
+        # returns detection ids, positions, body lengths and original values (rows)
+        ids = np.array(columns.get(self.id_label, []), dtype=int)
+        if len(ids) > len(np.unique(ids)):
+            # duplicate ids: keep the last values, in order of first occurrence
+            _, first_indices = np.unique(ids, return_index=True)
+            _, last_indices = np.unique(ids[::-1], return_index=True)
+            indices = (len(ids) - 1 - last_indices)[np.argsort(first_indices)]
+        else:
+            indices = np.arange(len(ids))
+        keypoints = np.full((len(ids), len(self.keypoints), 2), np.nan)
+        for keypointi, keypoint in enumerate(self.keypoints):
+            for coordi, coord in enumerate(['x', 'y']):
+                column = columns.get(f'{coord}_{keypoint}')
+                if column is not None:
+                    keypoints[:, keypointi, coordi] = np.array(column, dtype=float)
+        keypoints = keypoints[indices]
+        valid = ~np.any(np.isnan(keypoints), 2)
+        # position: middle keypoint, otherwise mean of available keypoints
+        positions = keypoints[:, (len(self.keypoints) - 1) // 2].copy()
+        missing = ~valid[:, (len(self.keypoints) - 1) // 2] & np.any(valid, 1)
+        if np.any(missing):
+            positions[missing] = np.nanmean(keypoints[missing], 1)
+        # length: sum of distances between consecutive available keypoints
+        lengths = np.zeros(len(indices))
+        last_keypoints = np.full((len(indices), 2), np.nan)
+        for keypointi in range(len(self.keypoints)):
+            keypoint = keypoints[:, keypointi]
+            dists = np.hypot(keypoint[:, 0] - last_keypoints[:, 0], keypoint[:, 1] - last_keypoints[:, 1])
+            lengths += np.nan_to_num(dists)
+            last_keypoints[valid[:, keypointi]] = keypoint[valid[:, keypointi]]
+        # detections without any keypoint can't be tracked
+        selected = np.any(valid, 1)
+        names = list(columns.keys())
+        rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+        return {'ids': ids[indices][selected],
+                'positions': positions[selected],
+                'lengths': lengths[selected],
+                'rows': [rows[index] for index in indices[selected]]}
+
+    def track_frame(self, framei, detections):
         def length_distance(length, mean_length):
             return abs(length - mean_length)
 
-        id_list = list(ids.keys())
+        ndetections = len(detections['ids'])
         # update tracks
-        for id, track in list(self.tracks.items()):
-            if not self.update_track(track, framei):
-                self.tracks.pop(id)
-        # find matching tracks (greedy matching)
-        id_positions = [id['position'] for id in ids.values()]
-        tracks_list = list(self.tracks.values())
-        track_positions = [track['position'] for track in tracks_list]
-        if len(id_positions) > 0 and len(track_positions) > 0:
-            distance_matrix = euclidean_distances(id_positions, track_positions)
-            #distance_matrix2 = pairwise_distances([id['length'] for id in ids.values()],
-            #                                      [track['mean_length'] for track in tracks_list],
+        ndeaths = self.update_tracks(framei)
+        # find matching tracks
+        slots = self.tracks.slots
+        nbirths = 0
+        ngated_out = ndetections
+        distances = np.zeros(0)
+        if ndetections > 0 and len(slots) > 0:
+            id_positions = detections['positions']
+            track_positions = self.tracks.positions[slots]
+            #distance_matrix2 = pairwise_distances(detections['lengths'],
+            #                                      self.tracks.mean_lengths[slots],
             #                                      metric=length_distance)
             #distance_matrix = distance_matrix1 + distance_matrix2
-            all_best_indices = []
-            best_dists = []
-            for id_index in range(len(ids)):
-                distances = distance_matrix[id_index]
-                best_indices = np.argsort(distances)
-                all_best_indices.append(best_indices)
-                best_dists.append(distances[best_indices[0]])
-            greedy_indices = np.argsort(best_dists)
-            for id_index in greedy_indices:
-                values = ids[id_list[id_index]]
-                position = values['position']
-                assigned = False
-                for match_track_index in all_best_indices[id_index]:
-                    track = tracks_list[match_track_index]
-                    distance = math.dist(track['position'], position)
-                    if not track['assigned'] and self.check_match(track, distance):
-                        if self.debug_mode and self.output:
-                            self.debug_writer.write({'distance': distance})
-                        self.assign_track(track, values, distance, framei)
-                        assigned = True
-                        break
-                if not assigned:
+            gates = self.calc_gates(slots)
+            if self.spatial_index:
+                nearest_distances, pairs = find_pairs_indexed(id_positions, track_positions, gates)
+            else:
+                nearest_distances, pairs = find_pairs(id_positions, track_positions, gates)
+            if self.assignment == 'optimal':
+                matches = match_optimal(ndetections, len(slots), pairs)
+            else:
+                matches = match_greedy(nearest_distances, len(slots), pairs)
+            assigned_slots = []
+            assigned_indices = []
+            distances = []
+            for id_index, track_index, distance in matches:
+                if track_index is not None:
+                    assigned_slots.append(slots[track_index])
+                    assigned_indices.append(id_index)
+                    distances.append(distance)
+                else:
                     # add tracks for any non-assigned ids
-                    self.add_track(values, framei)
+                    nbirths += self.add_track(detections, id_index, framei)
+            assigned_slots = np.array(assigned_slots, dtype=int)
+            distances = np.array(distances)
+            self.assign_tracks(assigned_slots, detections, np.array(assigned_indices, dtype=int), distances, framei)
+            ngated_out = ndetections - len(np.unique(pairs[0]))
+            if self.debug_writer is not None:
+                self.write_debug_rows(framei, assigned_slots, distances)
         else:
             # create tracks for all ids
-            for values in ids.values():
-                self.add_track(values, framei)
+            for id_index in range(ndetections):
+                nbirths += self.add_track(detections, id_index, framei)
+        if self.debug_stats is not None:
+            nunmatched = ndetections - len(distances)
+            self.debug_stats.add_frame(framei, distances, ngated_out, nunmatched - ngated_out,
+                                       nbirths, nunmatched - nbirths, ndeaths, len(self.tracks))
+
+    def write_debug_rows(self, framei, slots, distances):
+        # random sample of matches
+        selected = self.debug_random.random(len(distances)) < self.debug_sample_rate
+        if np.any(selected):
+            self.debug_writer.write_columns({'frame': [framei] * int(np.count_nonzero(selected)),
+                                             'track_id': self.tracks.ids[slots[selected]].tolist(),
+                                             'distance': distances[selected].tolist()})
 
-    def check_match(self, track, distance):
-        return distance < self.max_move_distance + track['inactive_count'] * self.move_distance
+    def calc_gates(self, slots):
+        # maximum match distance per track
+        return self.max_move_distance + self.tracks.inactive_counts[slots] * self.move_distance
 
-    def add_track(self, values, framei):
+    def add_track(self, detections, index, framei):
+        # returns whether track was added
         if self.max_individuals is not None and self.next_id < self.max_individuals:
-            self.tracks[self.next_id] = {'assigned': True,
-                                         'active_count': 0, 'inactive_count': 0, 'last_active': framei,
-                                         'mean_length': values['length'], 'delta': np.zeros(2)}
-            track = self.tracks[self.next_id]
-            track.update(values)
+            self.tracks.add(self.next_id, detections['positions'][index], detections['lengths'][index],
+                            detections['rows'][index], framei)
             self.next_id += 1
+            return True
+        return False
 
-    def assign_track(self, track, values, distance, framei):
+    def assign_tracks(self, slots, detections, indices, distances, framei):
         add_factor = 0.1
-        active_factor = calc_active_factor(track, self.min_active)
-        range_factor = calc_range_factor(track, distance, self.move_distance)
-        length = track['length'] if track['length'] is not None else track['mean_length']
-        length_factor = calc_length_factor(track, abs(length - values['length']))
-        match_factor = range_factor * length_factor * active_factor
-        delta = np.array(values['position']) - track['position']
-        track['delta'] = delta * add_factor + track['delta'] * (1 - add_factor)
-        track.update(values)
-        track['assigned'] = True
-        track['active_count'] += 1
-        track['inactive_count'] = 0
-        track['last_active'] = framei
-        track['mean_length'] = track['mean_length'] * (1 - match_factor) + length * match_factor
-
-    def update_track(self, track, framei):
-        if not track['assigned']:
-            track['inactive_count'] += 1
-            delta = track['delta']
-            l, angle = vector_to_polar(delta)
-            if l > self.move_distance:
-                delta = np.array(polar_to_vector([self.move_distance, angle]))
-            else:
-                delta *= 0.95
-            track['position'] = track['position'] + delta
-            track['delta'] = delta
-        track['assigned'] = False
-        active = framei - track['last_active'] < self.max_inactive if self.max_inactive else True
-        return active
-
-
-def calc_active_factor(track, min_active):
-    active_factor = min((track['active_count'] + 1) / (min_active + 1), 1)
-    return active_factor
-
-
-def calc_range_factor(track, distance, move_distance):
-    if track['inactive_count'] == 0:
-        range_factor = 1 - distance / move_distance
-    else:
-        factor_inactive = min(track['inactive_count'] * 0.1, 1)
-        range_factor = (1 - distance / (move_distance * factor_inactive)) / factor_inactive
-    return range_factor
-
-
-def calc_length_factor(track, length_dif):
-    length_factor = 1
-    l = track['mean_length']
-    if l == 0 and track['length'] is not None:
-        l = track['length']
-    if not np.isclose(l, 0):
-        length_factor = max(1 - length_dif / l, 0)
-    return length_factor
+        tracks = self.tracks
+        new_positions = detections['positions'][indices]
+        new_lengths = detections['lengths'][indices]
+        active_factors = calc_active_factor(tracks.active_counts[slots], self.min_active)
+        range_factors = calc_range_factor(tracks.inactive_counts[slots], distances, self.move_distance)
+        mean_lengths = tracks.mean_lengths[slots]
+        lengths = tracks.lengths[slots]
+        lengths = np.where(np.isnan(lengths), mean_lengths, lengths)
+        length_factors = calc_length_factor(mean_lengths, tracks.lengths[slots], np.abs(lengths - new_lengths))
+        match_factors = range_factors * length_factors * active_factors
+        deltas = new_positions - tracks.positions[slots]
+        tracks.deltas[slots] = deltas * add_factor + tracks.deltas[slots] * (1 - add_factor)
+        tracks.positions[slots] = new_positions
+        tracks.lengths[slots] = new_lengths
+        tracks.assigned[slots] = True
+        tracks.active_counts[slots] += 1
+        tracks.inactive_counts[slots] = 0
+        tracks.last_active[slots] = framei
+        tracks.mean_lengths[slots] = mean_lengths * (1 - match_factors) + lengths * match_factors
+        for slot, index in zip(slots, indices):
+            tracks.values[slot] = detections['rows'][index]
+
+    def update_tracks(self, framei):
+        # predict positions of unassigned tracks, remove inactive tracks; returns number of removed tracks
+        self.tracks.predict(self.move_distance)
+        return self.tracks.expire(framei, self.max_inactive)
+
+
+def frame_columns_iterator(batch_iterator, frame_label='frame', start_batch=0):
+    # group rows of consecutive batches by frame; yields (frame, columns, index of batch containing first row)
+    pending = None
+    pending_batchi = start_batch
+    for batchi, batch in enumerate(batch_iterator, start_batch):
+        if pending is not None:
+            batch = {name: pending[name] + values for name, values in batch.items()}
+        else:
+            pending_batchi = batchi
+        frames = np.array(batch[frame_label], dtype=int)
+        if len(frames) == 0:
+            continue
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(frames)) + 1])
+        # last frame may continue in next batch
+        for start, end in zip(starts[:-1], starts[1:]):
+            yield int(frames[start]), {name: values[start:end] for name, values in batch.items()}, pending_batchi
+            pending_batchi = batchi
+        pending = {name: values[starts[-1]:] for name, values in batch.items()}
+    if pending is not None:
+        yield int(pending[frame_label][0]), pending, pending_batchi
+
+
+def calc_chunk_ranges(frame_start, frame_end, frame_interval, nchunks, overlap):
+    # returns (tracking start, own start, end) frames per chunk; tracking starts overlap frames before own start
+    frames = range(frame_start, frame_end, frame_interval)
+    overlap_steps = int(np.ceil(overlap / frame_interval))
+    bounds = np.linspace(0, len(frames), nchunks + 1).astype(int)
+    chunk_ranges = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end > start:
+            chunk_end = frames[end] if end < len(frames) else frame_end
+            chunk_ranges.append((frames[max(start - overlap_steps, 0)], frames[start], chunk_end))
+    return chunk_ranges
+
+
+def track_chunk(job):
+    params, base_dir, input_files, video_input, output, chunk_info = job
+    chunk_info_filename = output + '_info.json'
+    if os.path.exists(chunk_info_filename):
+        os.remove(chunk_info_filename)
+    Tracker(params, base_dir, input_files, video_input, output, None).track()
+    with open(chunk_info_filename, 'w') as file:
+        file.write(format_chunk_info(chunk_info))
+
+
+def chunk_complete(output, chunk_info):
+    # chunk output complete and tracked with the same info
+    if not feather_file_complete(output + '.feather'):
+        return False
+    try:
+        with open(output + '_info.json') as file:
+            return file.read() == format_chunk_info(chunk_info)
+    except OSError:
+        return False
+
+
+def format_chunk_info(chunk_info):
+    return json.dumps(chunk_info, sort_keys=True, default=str)
+
+
+def feather_file_complete(filename):
+    # complete file: footer written on close
+    try:
+        with pyarrow.ipc.open_file(filename):
+            return True
+    except (OSError, pyarrow.ArrowInvalid):
+        return False
+
+
+def calc_distance_matrix(positions1, positions2):
+    return np.hypot(positions1[:, None, 0] - positions2[None, :, 0], positions1[:, None, 1] - positions2[None, :, 1])
+
+
+def find_pairs(id_positions, track_positions, gates):
+    # dense: all distances
+    # returns distance of closest track per id, and (id indices, track indices, distances) of pairs within gates
+    distance_matrix = calc_distance_matrix(id_positions, track_positions)
+    id_indices, track_indices = np.nonzero(distance_matrix < gates)
+    return np.min(distance_matrix, 1), (id_indices, track_indices, distance_matrix[id_indices, track_indices])
+
+
+def find_pairs_indexed(id_positions, track_positions, gates):
+    # spatial index: only distances within largest gate
+    track_tree = cKDTree(track_positions)
+    nearest_distances, _ = track_tree.query(id_positions)
+    id_tree = cKDTree(id_positions)
+    pairs = id_tree.sparse_distance_matrix(track_tree, np.max(gates), output_type='ndarray')
+    id_indices, track_indices = pairs['i'], pairs['j']
+    distances = np.hypot(*(id_positions[id_indices] - track_positions[track_indices]).T)
+    selected = distances < gates[track_indices]
+    return nearest_distances, (id_indices[selected], track_indices[selected], distances[selected])
+
+
+def match_greedy(nearest_distances, ntracks, pairs):
+    # process ids in order of their closest track, each takes the closest available track within its gate
+    # returns (id index, track index or None, distance) in processing order
+    id_indices, track_indices, distances = pairs
+    order = np.lexsort((track_indices, distances, id_indices))
+    id_indices, track_indices, distances = id_indices[order], track_indices[order], distances[order]
+    starts = np.searchsorted(id_indices, np.arange(len(nearest_distances) + 1))
+    available = np.ones(ntracks, dtype=bool)
+    matches = []
+    for id_index in np.argsort(nearest_distances):
+        match = (id_index, None, None)
+        for pair_index in range(starts[id_index], starts[id_index + 1]):
+            track_index = track_indices[pair_index]
+            if available[track_index]:
+                available[track_index] = False
+                match = (id_index, int(track_index), distances[pair_index])
+                break
+        matches.append(match)
+    return matches
+
+
+def match_optimal(nids, ntracks, pairs):
+    # maximise the number of matches within gates, then minimise their total distance
+    # solved independently for each connected group of ids and tracks
+    # returns (id index, track index or None, distance) in id order
+    id_indices, track_indices, distances = pairs
+    matches = [(id_index, None, None) for id_index in range(nids)]
+    if len(distances) == 0:
+        return matches
+    graph = coo_matrix((np.ones(len(distances)), (id_indices, nids + track_indices)), shape=(nids + ntracks,) * 2)
+    _, labels = connected_components(graph, directed=False)
+    pair_labels = labels[id_indices]
+    order = np.argsort(pair_labels, kind='stable')
+    starts = np.flatnonzero(np.diff(pair_labels[order], prepend=-1, append=-1))
+    for start, end in zip(starts[:-1], starts[1:]):
+        selected = order[start:end]
+        group_ids, group_id_indices = np.unique(id_indices[selected], return_inverse=True)
+        group_tracks, group_track_indices = np.unique(track_indices[selected], return_inverse=True)
+        gate_cost = np.sum(distances[selected]) + 1
+        cost_matrix = np.full((len(group_ids), len(group_tracks)), gate_cost)
+        cost_matrix[group_id_indices, group_track_indices] = distances[selected]
+        for id_index, track_index in zip(*linear_sum_assignment(cost_matrix)):
+            if cost_matrix[id_index, track_index] < gate_cost:
+                matches[group_ids[id_index]] = (group_ids[id_index], int(group_tracks[track_index]),
+                                                cost_matrix[id_index, track_index])
+    return matches
+
+
+def calc_active_factor(active_counts, min_active):
+    return np.minimum((active_counts + 1) / (min_active + 1), 1)
+
+
+def calc_range_factor(inactive_counts, distances, move_distance):
+    # inactive tracks: allowed range grows with inactive count
+    factors_inactive = np.where(inactive_counts == 0, 1, np.minimum(inactive_counts * 0.1, 1))
+    return (1 - distances / (move_distance * factors_inactive)) / factors_inactive
+
+
+def calc_length_factor(mean_lengths, lengths, length_difs):
+    l = np.where((mean_lengths == 0) & ~np.isnan(lengths), lengths, mean_lengths)
+    valid = ~np.isclose(l, 0)
+    length_factors = np.ones(len(l))
+    length_factors[valid] = np.maximum(1 - length_difs[valid] / l[valid], 0)
+    return length_factors
@@ -0,0 +1,113 @@
+import json
+import math
+import numpy as np
+
+
+class QuantileSketch:
+    # streaming quantiles within relative accuracy, using logarithmic bins (DDSketch)
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        small = values < self.min_value
+        self.zero_count += int(np.count_nonzero(small))
+        self.count += len(values)
+        indices = np.ceil(np.log(values[~small]) / self.log_gamma).astype(int)
+        for index, count in zip(*np.unique(indices, return_counts=True)):
+            self.bins[index] = self.bins.get(index, 0) + int(count)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        total = self.zero_count
+        if rank < total:
+            return 0.0
+        for index in sorted(self.bins):
+            total += self.bins[index]
+            if rank < total:
+                # centre of bin (gamma^(index-1), gamma^index]
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class TrackingStats:
+    # aggregated tracking statistics per window of frames, written as json lines
+    def __init__(self, filename, interval=1000, histogram_edges=None, append=False):
+        self.file = open(filename, 'a' if append else 'w')
+        self.interval = interval
+        if histogram_edges is None:
+            histogram_edges = np.linspace(0, 10, 11)
+        self.histogram_edges = np.asarray(histogram_edges, dtype=float)
+        self.start_window(None)
+
+    def start_window(self, framei):
+        self.frame_start = framei
+        self.frame_end = framei
+        self.nframes = 0
+        self.sketch = QuantileSketch()
+        # histogram with overflow bin
+        self.histogram = np.zeros(len(self.histogram_edges), dtype=int)
+        self.distance_sum = 0
+        self.distance_min = math.inf
+        self.distance_max = -math.inf
+        self.unmatched_gated_out = 0
+        self.unmatched_conflict = 0
+        self.births = 0
+        self.births_rejected = 0
+        self.deaths = 0
+        self.active_tracks_sum = 0
+
+    def add_frame(self, framei, distances, ngated_out, nconflict, nbirths, nbirths_rejected, ndeaths, nactive):
+        # distances: match distances; gated out: unmatched without track in range; conflict: tracks in range taken
+        if self.frame_start is None:
+            self.frame_start = framei
+        self.frame_end = framei
+        self.nframes += 1
+        if len(distances) > 0:
+            self.sketch.add(distances)
+            indices = np.searchsorted(self.histogram_edges, distances, side='right') - 1
+            self.histogram += np.bincount(np.clip(indices, 0, len(self.histogram) - 1),
+                                          minlength=len(self.histogram))
+            self.distance_sum += float(np.sum(distances))
+            self.distance_min = min(self.distance_min, float(np.min(distances)))
+            self.distance_max = max(self.distance_max, float(np.max(distances)))
+        self.unmatched_gated_out += ngated_out
+        self.unmatched_conflict += nconflict
+        self.births += nbirths
+        self.births_rejected += nbirths_rejected
+        self.deaths += ndeaths
+        self.active_tracks_sum += nactive
+        if self.nframes >= self.interval:
+            self.write_summary()
+            self.start_window(None)
+
+    def write_summary(self):
+        if self.nframes == 0:
+            return
+        nmatches = self.sketch.count
+        summary = {'frame_start': self.frame_start, 'frame_end': self.frame_end, 'frames': self.nframes,
+                   'matches': nmatches,
+                   'unmatched_gated_out': self.unmatched_gated_out, 'unmatched_conflict': self.unmatched_conflict,
+                   'births': self.births, 'births_rejected': self.births_rejected, 'deaths': self.deaths,
+                   'active_tracks_mean': round(self.active_tracks_sum / self.nframes, 3)}
+        if nmatches > 0:
+            summary['distance'] = {
+                'mean': round(self.distance_sum / nmatches, 6),
+                'min': round(self.distance_min, 6),
+                'max': round(self.distance_max, 6),
+                'quantiles': {f'p{int(q * 100)}': round(self.sketch.quantile(q), 6) for q in [0.5, 0.9, 0.99]},
+                'histogram': {'edges': self.histogram_edges.tolist(), 'counts': self.histogram.tolist()},
+            }
+        self.file.write(json.dumps(summary) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.write_summary()
+        self.file.close()
@@ -1,14 +1,18 @@
 import csv
 from datetime import timedelta
+import multiprocessing
 import os
 from tqdm import tqdm
 
 from src.VideoInfo import VideoInfos
-from src.Data import Data, create_datas
+from src.Data import Data, create_datas, calc_profiles, ACTIVITY_TYPES, FEATURE_COLUMNS
 from src.pipeline.analyse_contact import extract_contact_events
 from src.pipeline.analyse_paths import extract_path_events
-from src.util import list_to_str, get_bio_base_name, get_input_files, \
-    find_all_filename_infos, get_input_stats, filter_output_files
+from src.util import list_to_str, get_bio_base_name, get_input_files, filter_output_files, FilenameIndex, \
+    parallel_map
+
+
+PATH_FILE_OUTPUTS = ['output', 'image_output', 'raw_image_output', 'video_output']
 
 
 def run(all_params, params):
@@ -17,7 +21,12 @@ def run(all_params, params):
     fps = general_params.get('fps')
     pixel_size = general_params.get('pixel_size')
     window_size = str(general_params.get('window_size'))
+    window_method = general_params.get('window_method', 'fast')
+    window_sizes = general_params.get('window_sizes')
     add_missing_data_flag = bool(general_params.get('add_missing', False))
+    workers = general_params.get('workers')
+    # stream: read and process one data set (files with the same info) at a time
+    stream = bool(general_params.get('stream_features', False))
 
     input_files = get_input_files(general_params, params, 'input')
     if len(input_files) == 0:
@@ -27,20 +36,53 @@ def run(all_params, params):
     print(f'Video files: {len(video_files)}')
     video_infos = VideoInfos(video_files)
     print(f'Total length: {timedelta(seconds=int(video_infos.total_length))} (frames: {video_infos.total_frames})')
-    print(get_input_stats(input_files))
-
-    print('Reading input files')
-    datas = create_datas(input_files, fps=fps, pixel_size=pixel_size, window_size=window_size)
-    if add_missing_data_flag:
-        datas = add_missing_data(datas, input_files)
-        print(f'Added missing data to total of: {len(datas)}')
+    filename_index = FilenameIndex(input_files)
+    print(filename_index.get_stats())
 
+    all_infos, all_ids = filename_index.infos, filename_index.ids
     header_start = ['ID']
-    nheaders = max([len(data.info) for data in datas])
+    nheaders = filename_index.get_max_info_length()
     for i in range(nheaders):
         header_start += [f'info{i + 1}']
 
-    features_done = []
+    if stream:
+        file_groups = filename_index.get_groups()
+    else:
+        file_groups = {None: input_files}
+    csv_files = {}
+    # single process pool for reading all data sets
+    pool = multiprocessing.Pool(workers) if stream and workers != 1 else None
+    try:
+        for info, files in file_groups.items():
+            if stream:
+                print(f'[Data set: {info}]')
+            print('Reading input files')
+            datas = create_datas(files, fps=fps, pixel_size=pixel_size, window_size=window_size,
+                                 window_method=window_method, window_sizes=window_sizes, workers=workers, pool=pool)
+            if add_missing_data_flag:
+                infos = all_infos if info is None else [info.split('_')]
+                datas = add_missing_data(datas, infos, all_ids)
+                print(f'Added missing data to total of: {len(datas)}')
+            extract_feature_sets(datas, params, general_params, header_start, nheaders, video_infos, csv_files)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for csvfile, _ in csv_files.values():
+            csvfile.close()
+
+
+def get_csv_writer(csv_files, filename, create_header):
+    # output file is created with header on first use, rows of later data sets are appended
+    if filename not in csv_files:
+        csvfile = open(filename, 'w', newline='')
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(create_header())
+        csv_files[filename] = csvfile, csvwriter
+    return csv_files[filename][1]
+
+
+def extract_feature_sets(datas, params, general_params, header_start, nheaders, video_infos, csv_files):
+    base_dir = general_params['base_dir']
     for feature_set0 in params:
         feature_type = next(iter(feature_set0))
         feature_set = feature_set0[feature_type]
@@ -50,37 +92,32 @@ def run(all_params, params):
         if feature_type == 'profiles':
             for data in tqdm(datas):
                 if data.has_data:
-                    data.calc_windows()
                     data.calc_means()
-                    data.calc_profiles()
+            bin_edges = calc_profiles(datas)
 
             for feature in features:
                 output_filename = os.path.join(base_dir, feature_set['output'].format_map({'feature': feature}))
-                header = header_start + list_to_str(datas[0].profiles[feature][1])
-                with open(output_filename, 'w', newline='') as csvfile:
-                    csvwriter = csv.writer(csvfile)
-                    csvwriter.writerow(header)
-                    for data in datas:
-                        row = list_to_str(data.id_info)
-                        if data.has_data:
-                            row += list_to_str(data.profiles[feature][0])
-                        csvwriter.writerow(row)
+                csvwriter = get_csv_writer(csv_files, output_filename,
+                                           lambda: header_start + list_to_str(bin_edges[feature]))
+                for data in datas:
+                    row = list_to_str(data.id_info)
+                    if data.has_data:
+                        row += list_to_str(data.profiles[feature][0])
+                    csvwriter.writerow(row)
 
         elif feature_type == 'features':
             output_filename = os.path.join(base_dir, feature_set['output'])
             header = list(header_start)
             for feature in features:
-                header += list(datas[0].features[feature].keys())
+                header += FEATURE_COLUMNS[feature]
 
-            with open(output_filename, 'w', newline='') as csvfile:
-                csvwriter = csv.writer(csvfile)
-                csvwriter.writerow(header)
-                for data in datas:
-                    row = list_to_str(data.id_info)
-                    if data.has_data:
-                        for feature in features:
-                            row += list_to_str(data.features[feature].values())
-                    csvwriter.writerow(row)
+            csvwriter = get_csv_writer(csv_files, output_filename, lambda: header)
+            for data in datas:
+                row = list_to_str(data.id_info)
+                if data.has_data:
+                    for feature in features:
+                        row += list_to_str(data.features[feature].values())
+                csvwriter.writerow(row)
 
         elif feature_type == 'activity':
             for feature in features:
@@ -89,77 +126,73 @@ def run(all_params, params):
                         data.classify_activity(output_type=feature)
                 output_filename = os.path.join(base_dir, feature_set['output'].format_map({'feature': feature}))
 
-                activity_types = [key for key in datas[0].get_activities_time().keys() if key != '']
+                activity_types = [key for key in ACTIVITY_TYPES[feature] if key != '']
                 header = list(header_start)
                 for activity_type in activity_types:
                     header += [f'{activity_type} [s]', f'{activity_type} [%]']
 
-                with open(output_filename, 'w', newline='') as csvfile:
-                    csvwriter = csv.writer(csvfile)
-                    csvwriter.writerow(header)
-                    for data in datas:
-                        row = list_to_str(data.id_info)
-                        if data.has_data:
-                            video_info = video_infos.find_match(get_bio_base_name(data.filetitle))
-                            if video_info is not None:
-                                total_frames = video_info.total_frames
-                            else:
-                                total_frames = None
-                            data.classify_activity(output_type=feature)
-
-                            for activity_type in activity_types:
-                                row.append(data.get_activity_time(activity_type))
-                                row.append(data.get_activity_fraction(activity_type, total_frames))
-                        csvwriter.writerow(row)
+                csvwriter = get_csv_writer(csv_files, output_filename, lambda: header)
+                for data in datas:
+                    row = list_to_str(data.id_info)
+                    if data.has_data:
+                        video_info = video_infos.find_match(get_bio_base_name(data.filetitle))
+                        if video_info is not None:
+                            total_frames = video_info.total_frames
+                        else:
+                            total_frames = None
+                        data.classify_activity(output_type=feature)
+
+                        for activity_type in activity_types:
+                            row.append(data.get_activity_time(activity_type))
+                            row.append(data.get_activity_fraction(activity_type, total_frames))
+                    csvwriter.writerow(row)
 
         elif feature_type == 'events':
             outputs = extract_events(datas, features, feature_set, general_params)
             if 'output' in feature_set:
                 output_filename = os.path.join(base_dir, feature_set['output'])
 
-                nheaders = max([len(data.info) for data in datas])
                 header = []
                 for i in range(nheaders):
                     header += [f'info{i + 1}']
                 header += list(features)
 
-                with open(output_filename, 'w', newline='') as csvfile:
-                    csvwriter = csv.writer(csvfile)
-                    csvwriter.writerow(header)
-                    for key in outputs:
-                        info = key.split('_')
-                        row = info + outputs[key]
-                        csvwriter.writerow(row)
-
-        features_done.append(feature_type)
+                csvwriter = get_csv_writer(csv_files, output_filename, lambda: header)
+                for key in outputs:
+                    info = key.split('_')
+                    row = info + outputs[key]
+                    csvwriter.writerow(row)
 
 
 def extract_events(datas, features, params, general_params):
+    # data sets processed in parallel, output in order of first occurrence
     event_type = params['type']
-    output = {}
-    data_set_infos = list(set(['_'.join(data.info) for data in datas]))
-    for data_set_info in tqdm(data_set_infos):
-        datas1 = [data for data in datas if data_set_info == '_'.join(data.info)]
-        if 'contact' in event_type:
-            output[data_set_info] = extract_contact_events(datas1, features, params)
-        elif 'path' in event_type:
-            output[data_set_info] = extract_path_events(datas1, features, params, general_params)
-    return output
-
-
-def add_missing_data(datas0, files):
+    workers = general_params.get('workers')
+    data_sets = {}
+    for data in datas:
+        data_sets.setdefault('_'.join(data.info), []).append(data)
+    if 'path' in event_type and any(params.get(key) for key in PATH_FILE_OUTPUTS):
+        # data sets write to the same per-frame csv / image / video files
+        workers = 1
+    jobs = [(event_type, datas1, features, params, general_params) for datas1 in data_sets.values()]
+    outputs = parallel_map(extract_data_set_events, jobs, workers, progress=True)
+    return {data_set_info: output for data_set_info, output in zip(data_sets, outputs) if output is not None}
+
+
+def extract_data_set_events(job):
+    event_type, datas, features, params, general_params = job
+    if 'contact' in event_type:
+        return extract_contact_events(datas, features, params)
+    elif 'path' in event_type:
+        return extract_path_events(datas, features, params, general_params)
+    return None
+
+
+def add_missing_data(datas0, infos, ids):
     datas = datas0.copy()
-    all_infos, all_ids = find_all_filename_infos(files)
-    for info in all_infos:
-        for id in all_ids:
-            id_info = [id] + info
-            if not contains_data(datas, id_info):
+    id_infos = {tuple(data.id_info) for data in datas}
+    for info in infos:
+        for id in ids:
+            if (id, *info) not in id_infos:
                 datas.append(Data(info=info, id=id))
     return datas
-
-
-def contains_data(datas, id_info):
-    for data in datas:
-        if data.id_info == id_info:
-            return True
-    return False
@@ -1,13 +1,13 @@
 from src.pipeline.ImageProcessing import ImageProcessing
-from src.util import get_input_files
+from src.util import get_input_files, try_path_join
 
 
 def run(all_params, params):
     general_params = all_params['general']
     base_dir = general_params['base_dir']
     input_files = get_input_files(general_params, params, 'input')
-    output = get_input_files(general_params, params, 'output')
-    video_output = get_input_files(general_params, params, 'video_output')
+    output = try_path_join(base_dir, params.get('output'))
+    video_output = try_path_join(base_dir, params.get('video_output'))
     if len(input_files) == 0:
         raise ValueError('Missing input files')
 
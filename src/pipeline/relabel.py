@@ -32,7 +32,7 @@ def run(all_params, params):
     if method.lower() == 'annotation':
         annotate(annotation_image_filename, annotation_filename, annotation_margin)
 
-    relabeller = Relabeller(params, annotation_filename)
+    relabeller = Relabeller(params, annotation_filename, workers=general_params.get('workers'))
     relabeller.relabel_all(input_files, output_dir, video_files)
 
 
@@ -2,7 +2,7 @@ import cv2 as cv
 import os
 from tqdm import tqdm
 
-from src.Data import read_data
+from src.Data import read_datas
 from src.file.FeatherFileReader import FeatherFileReader
 from src.file.FeatherStreamReader import FeatherStreamReader
 from src.util import *
@@ -23,7 +23,8 @@ def run(all_params, params):
     if stream:
         annotate_stream_video(input_files, video_files, video_output_path, params)
     else:
-        annotate_merge_videos(input_files, video_files, video_output_path, params)
+        annotate_merge_videos(input_files, video_files, video_output_path, params,
+                              workers=general_params.get('workers'))
 
 
 def annotate_stream_video(input_files, video_files, video_output, params):
@@ -68,15 +69,20 @@ def annotate_stream_video(input_files, video_files, video_output, params):
         vidwriter.write(image)
     vidwriter.release()
 
-def annotate_merge_videos(input_files, video_files, video_output, params):
+def annotate_merge_videos(input_files, video_files, video_output, params, workers=1):
     print('Reading label data')
-    all_datas = {}
+    video_input_files = {}
     for video_file in video_files:
         video_title = get_filetitle_replace(video_file)
+        video_input_files[video_title] = [filename for filename in input_files
+                                          if video_title in filename or len(input_files) == 1 or len(video_files) == 1]
+    filenames = list(dict.fromkeys(filename for filenames in video_input_files.values() for filename in filenames))
+    file_datas = dict(zip(filenames, read_datas(filenames, workers=workers)))
+    all_datas = {}
+    for video_title, filenames in video_input_files.items():
         datas = {}
-        for filename in input_files:
-            if video_title in filename or len(input_files) == 1 or len(video_files) == 1:
-                datas |= read_data(filename)
+        for filename in filenames:
+            datas |= file_datas[filename]
         all_datas[video_title] = datas
     print('Creating annotated video')
     annotate_videos(video_files, video_output, all_datas, params)
@@ -0,0 +1,142 @@
+import itertools
+import numpy as np
+from scipy.spatial import cKDTree
+
+from src.file.CsvStreamWriter import CsvStreamWriter
+from src.file.FeatherFileReader import FeatherFileReader
+from src.file.FeatherStreamReader import FeatherStreamReader
+from src.pipeline.Tracker import Tracker, frame_columns_iterator
+from src.util import get_input_files, try_path_join, parallel_map
+
+
+sweep_data = {}
+
+
+def run(all_params, params):
+    general_params = all_params['general']
+    base_dir = general_params['base_dir']
+    input_files = get_input_files(general_params, params, 'input')
+    if len(input_files) == 0:
+        raise ValueError('Missing input files')
+    if 'video_input' in params or 'video_input' in general_params:
+        # only used for frame rate
+        video_input = get_input_files(general_params, params, 'video_input')
+    else:
+        video_input = []
+    output = try_path_join(base_dir, params.get('output'))
+    # sweep: list of values per tracking parameter; all combinations are tracked
+    sweep = params.get('sweep', {})
+    configs = [dict(zip(sweep.keys(), values)) for values in itertools.product(*sweep.values())]
+    # annotation: ground truth positions with identity label
+    if 'annotation' in params:
+        annotation_files = get_input_files(general_params, params, 'annotation')
+        annotations = read_annotations(annotation_files, params.get('annotation_id_label', 'track_id'),
+                                       params.get('annotation_position', ['x_body', 'y_body']))
+    else:
+        annotations = None
+    match_distance = params.get('match_distance', 10)
+
+    frames = read_frames(input_files)
+    tracking_params = {key: value for key, value in params.items()
+                       if key not in ['sweep', 'annotation', 'output', 'video_output', 'debug_mode']}
+    if 'frame_end' not in tracking_params and frames:
+        tracking_params['frame_end'] = max(frames) + 1
+    jobs = [(tracking_params | config, base_dir, video_input) for config in configs]
+    results = parallel_map(sweep_track, jobs, params.get('workers'),
+                           initializer=init_sweep_data, initargs=(frames, annotations, match_distance))
+
+    data_writer = CsvStreamWriter(output + '.csv') if output else None
+    for config, metrics in zip(configs, results):
+        print(' '.join(f'{key}: {value}' for key, value in (config | metrics).items()))
+        if data_writer is not None:
+            data_writer.write(config | metrics)
+    if data_writer is not None:
+        data_writer.close()
+
+
+def read_frames(input_files):
+    # all detections as columns per frame
+    try:
+        data_reader = FeatherStreamReader(input_files)
+    except Exception as e:
+        print(f'Warning: unable to open input files as stream ({e})')
+        data_reader = FeatherFileReader(input_files)
+    return {framei: columns for framei, columns, _ in frame_columns_iterator(data_reader.get_batch_iterator())}
+
+
+def read_annotations(input_files, id_label, position_labels):
+    # returns per frame: annotation ids, positions
+    annotations = {}
+    for framei, columns in read_frames(input_files).items():
+        positions = np.array([columns[label] for label in position_labels], dtype=float).T
+        annotations[framei] = (np.array(columns[id_label]), positions)
+    return annotations
+
+
+def init_sweep_data(frames, annotations, match_distance):
+    sweep_data['frames'] = frames
+    sweep_data['annotations'] = annotations
+    sweep_data['match_distance'] = match_distance
+
+
+def sweep_track(job):
+    params, base_dir, video_input = job
+    frames = sweep_data['frames']
+    tracker = Tracker(params, base_dir, [], video_input, None, None)
+    frame_range = range(tracker.frame_start, tracker.frame_end, tracker.frame_interval)
+    ndetections = 0
+    tracked = {}
+    for framei in frame_range:
+        detections = tracker.calc_frame_features(frames.get(framei, {}))
+        ndetections += len(detections['ids'])
+        tracker.track_frame(framei, detections)
+        tracks = tracker.tracks
+        slots = tracks.slots[tracks.assigned[tracks.slots]]
+        tracked[framei] = (tracks.ids[slots], tracks.positions[slots])
+    metrics = calc_track_metrics(len(frame_range), ndetections, tracked)
+    if sweep_data['annotations'] is not None:
+        metrics |= calc_annotation_metrics(tracked, sweep_data['annotations'], sweep_data['match_distance'])
+    return metrics
+
+
+def calc_track_metrics(nframes, ndetections, tracked):
+    # fragmentation: number of tracks relative to mean number of detections per frame (1: no fragmentation)
+    track_ids = np.concatenate([ids for ids, _ in tracked.values()] + [np.zeros(0, dtype=int)])
+    track_lengths = np.unique(track_ids, return_counts=True)[1]
+    ntracks = len(track_lengths)
+    mean_detections = ndetections / nframes if nframes > 0 else 0
+    return {'tracks': ntracks,
+            'mean_track_length': float(np.mean(track_lengths)) if ntracks > 0 else 0,
+            'assigned_fraction': len(track_ids) / ndetections if ndetections > 0 else 0,
+            'fragmentation': ntracks / mean_detections if mean_detections > 0 else 0}
+
+
+def calc_annotation_metrics(tracked, annotations, match_distance):
+    # match annotations to closest tracked position; identity of annotation is the track it is mostly matched with
+    # match_rate: fraction of annotations matched with their identity track
+    annotation_ids = []
+    matched_ids = []
+    for framei, (ids, positions) in annotations.items():
+        matched = np.full(len(ids), -1)
+        if framei in tracked and len(tracked[framei][0]) > 0:
+            track_ids, track_positions = tracked[framei]
+            distances, indices = cKDTree(track_positions).query(positions, distance_upper_bound=match_distance)
+            found = np.isfinite(distances)
+            matched[found] = track_ids[indices[found]]
+        annotation_ids.append(ids)
+        matched_ids.append(matched)
+    if not annotation_ids:
+        return {}
+    annotation_ids = np.concatenate(annotation_ids)
+    matched_ids = np.concatenate(matched_ids)
+    ncorrect = 0
+    ntracks_per_id = []
+    for annotation_id in np.unique(annotation_ids):
+        id_matches = matched_ids[(annotation_ids == annotation_id) & (matched_ids >= 0)]
+        if len(id_matches) > 0:
+            counts = np.unique(id_matches, return_counts=True)[1]
+            ncorrect += np.max(counts)
+            ntracks_per_id.append(len(counts))
+    return {'detected_rate': float(np.mean(matched_ids >= 0)),
+            'match_rate': ncorrect / len(annotation_ids),
+            'tracks_per_identity': float(np.mean(ntracks_per_id)) if ntracks_per_id else 0}
@@ -14,4 +14,7 @@ def run(all_params, params):
         raise ValueError('Missing input files')
 
     tracker = Tracker(params, base_dir, input_files, video_input, output, video_output, debug_mode=debug_mode)
-    tracker.track()
+    if tracker.chunks > 1:
+        tracker.track_chunks()
+    else:
+        tracker.track(resume=general_params.get('resume', False))
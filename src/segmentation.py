@@ -1,9 +1,28 @@
 import cv2 as cv
 import numpy as np
+from scipy import fft
 
 from src.util import *
 
 
+def create_gabor_filters(scale=1):
+    # This function is designed to produce a set of GaborFilters
+    # an even distribution of theta values equally distributed amongst pi rad / 180 degree
+    # scale: create equivalent filters for an image resized by this factor
+    filters = []
+    num_filters = 16
+    ksize = int(35 * scale) | 1  # The local area to evaluate (odd)
+    sigma = 3.0 * scale  # Larger Values produce more edges
+    lambd = 10.0 * scale
+    gamma = 0.5
+    psi = 0  # Offset value - lower generates cleaner results
+    for theta in np.arange(0, np.pi, np.pi / num_filters):  # Theta is the orientation for edge detection
+        kern = cv.getGaborKernel((ksize, ksize), sigma, theta, lambd, gamma, psi, ktype=cv.CV_64F)
+        kern /= 1.0 * kern.sum()  # Brightness normalization
+        filters.append(kern)
+    return filters
+
+
 def gabor_filtering(image, texture_filters):
     # This general function is designed to apply filters to our image
     # First create a numpy array the same size as our input image
@@ -15,7 +34,49 @@ def gabor_filtering(image, texture_filters):
     for kern in texture_filters:  # Loop through the kernels in our GaborFilter
         image_filter = cv.filter2D(image, depth, kern)  # Apply filter to image
         # Using Numpy.maximum to compare our filter and cumulative image, taking the higher value (max)
-        np.maximum(new_image, image_filter, new_image)
+        np.maximum(new_image, image_filter, out=new_image)
+    return new_image
+
+
+def gabor_filtering_fft(image, texture_filters, tile_size=512, kernel_spectra=None):
+    # Same result as gabor_filtering, using FFT convolution (overlap-save):
+    # each tile is transformed once and shared by all kernels, instead of one (DFT based) filter2D per kernel
+    # kernel_spectra: optional dict used to cache kernel transforms between calls
+    if kernel_spectra is None:
+        kernel_spectra = {}
+    height, width = image.shape[:2]
+    ksize = texture_filters[0].shape[0]
+    border = ksize // 2
+    # match filter2D default border handling
+    padded = cv.copyMakeBorder(image, border, border, border, border, cv.BORDER_REFLECT_101)
+    # filter in floating point, integer result converted (rounded, saturated) at the end as filter2D does
+    is_integer = np.issubdtype(image.dtype, np.integer)
+    dtype = np.float64 if is_integer else image.dtype
+    padded = padded.astype(dtype, copy=False)
+    if tile_size is None:
+        tile_size = max(height, width)
+    new_image = np.empty(image.shape, dtype=dtype)
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+            tile = padded[y0:y1 + 2 * border, x0:x1 + 2 * border]
+            fft_shape = tuple(fft.next_fast_len(size, real=True) for size in tile.shape)
+            spectra = kernel_spectra.get((fft_shape, dtype))
+            if spectra is None:
+                # flip kernels: filter2D computes correlation, FFT multiplication gives convolution
+                spectra = [fft.rfft2(np.flip(kern).astype(dtype), fft_shape) for kern in texture_filters]
+                kernel_spectra[fft_shape, dtype] = spectra
+            tile_spectrum = fft.rfft2(tile, fft_shape, workers=-1)
+            new_tile = new_image[y0:y1, x0:x1]
+            new_tile.fill(0)
+            for spectrum in spectra:
+                # only the part not affected by circular wrap-around is valid
+                image_filter = fft.irfft2(tile_spectrum * spectrum, fft_shape, workers=-1)
+                image_filter = image_filter[ksize - 1:ksize - 1 + y1 - y0, ksize - 1:ksize - 1 + x1 - x0]
+                np.maximum(new_tile, image_filter, out=new_tile)
+    if is_integer:
+        limits = np.iinfo(image.dtype)
+        new_image = np.clip(np.rint(new_image), limits.min, limits.max).astype(image.dtype)
     return new_image
 
 
@@ -23,27 +84,64 @@ def edge_detection(image, min_interval=120, max_interval=250):
     return cv.Canny(int_image(image), min_interval, max_interval)
 
 
+def detect_components(image, min_area=1):
+    # detect connected components in binary image, with (pixel based) moment features computed for all at once
+    nlabels, labels, stats, centroids = cv.connectedComponentsWithStats(int_image(image), connectivity=8)
+    ys, xs = np.nonzero(labels)
+    component_labels = labels[ys, xs]
+    m00 = np.bincount(component_labels, minlength=nlabels)[1:].astype(float)
+    m10, m01, m20, m02, m11 = [np.bincount(component_labels, weights=weights, minlength=nlabels)[1:]
+                               for weights in [xs, ys, xs * xs, ys * ys, xs * ys]]
+    x, y = m10 / m00, m01 / m00
+    # central moments; add pixel extent (1/12) to make lengths match the object size
+    mu20 = m20 / m00 - x * x + 1 / 12
+    mu02 = m02 / m00 - y * y + 1 / 12
+    mu11 = m11 / m00 - x * y
+    common = (mu20 + mu02) / 2
+    diff = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    length_major = np.sqrt(12 * (common + diff))
+    length_minor = np.sqrt(12 * np.clip(common - diff, 0, None))
+    angle = 0.5 * np.arctan2(2 * mu11, mu20 - mu02)
+    # head / tail: extremes along major axis
+    dx = np.cos(angle) * length_major / 2
+    dy = np.sin(angle) * length_major / 2
+
+    selected = stats[1:, cv.CC_STAT_AREA] >= min_area
+    x, y, dx, dy, area, length_major, length_minor, angle = \
+        [values[selected] for values in [x, y, dx, dy, m00, length_major, length_minor, angle]]
+    detections = {
+        'id': np.arange(len(x)),
+        'x_head': x + dx, 'y_head': y + dy,
+        'x_body': x, 'y_body': y,
+        'x_tail': x - dx, 'y_tail': y - dy,
+        'area': area,
+        'length_major': length_major, 'length_minor': length_minor,
+        'angle': np.rad2deg(angle),
+    }
+    return detections
+
+
 def segment(image, original_image=None):
     # labels1 = dist_watershed_image(image)
     # labels2 = dist_watershed_image2(image)
     contours = get_contours(image)
+    all_areas = [get_area(contour) for contour in contours]
     min_area = 1
-    areas = [get_area(contour) for contour in contours if get_area(contour) > min_area]
+    areas = [area for area in all_areas if area > min_area]
     min_area = np.mean(areas) / 2
-    areas2 = [get_area(contour) for contour in contours if get_area(contour) > min_area]
+    areas2 = [area for area in all_areas if area > min_area]
     mean_area = np.median(areas2)
     min_area = mean_area / 2
-    contours2 = [contour for contour in contours if get_area(contour) > min_area]
-    shapes = [get_lengths(contour) for contour in contours2]
+    contours2 = [(contour, area) for contour, area in zip(contours, all_areas) if area > min_area]
+    shapes = [get_lengths(contour) for contour, _ in contours2]
     mean_shape = np.median(shapes, 0) / 2
 
     contours3 = []
-    for contour in contours2:
-        area = get_area(contour)
+    for contour, area in contours2:
         n = int(np.round(area / mean_area))
         if n > 1:
             min_distance = mean_shape[1]
-            contours3.extend(split_contour_gamma(contour, n, min_distance, original_image))
+            contours3.extend(split_contour_levels(contour, n, min_distance, original_image))
         else:
             contours3.append(contour)
 
@@ -68,6 +166,31 @@ def split_contour_gamma(contour, n, min_distance, image):
     return final_contours
 
 
+def split_contour_levels(contour, n, min_distance, image, thresholds=np.arange(0, 1, 0.05)):
+    # same result as split_contour_gamma, extracting the contours of all threshold levels in a single pass:
+    # thresholded crops are placed side by side (separated by background), the level of each contour follows from x
+    final_contours = [contour]
+    cropped = grayscale_image(extract_image(image, contour))
+    contour_offset = np.min(contour, 0).astype(int)
+    height, width = cropped.shape
+    thresholds = thresholds[thresholds < np.max(cropped)]
+    nlevels = len(thresholds)
+    block_width = width + 1
+    levels_image = np.zeros((height, nlevels, block_width), dtype=np.uint8)
+    np.greater(cropped[:, None, :], thresholds.astype(cropped.dtype)[None, :, None], out=levels_image[..., :width])
+    contours0 = cv.findContours(levels_image.reshape(height, -1), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    contours = contours0[0] if len(contours0) == 2 else contours0[1]
+    contour_levels = np.array([contour1[0, 0, 0] for contour1 in contours], dtype=int) // block_width
+    counts = np.bincount(contour_levels, minlength=nlevels)
+    levels = np.flatnonzero(counts >= n)
+    if len(levels) > 0:
+        level = levels[0]
+        level_offset = contour_offset - (level * block_width, 0)
+        final_contours = [contours[i][:, 0, :] + level_offset for i in np.flatnonzero(contour_levels == level)]
+
+    return final_contours
+
+
 def split_contour(contour, n, min_distance, image):
     contours = []
     cropped = extract_image(image, contour)
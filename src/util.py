@@ -1,17 +1,19 @@
 import cmath
-from collections import deque
+from collections import deque, Counter
 import colorsys
 import cv2 as cv
 import glob
 import math
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 import re
 from scipy.ndimage import uniform_filter1d, distance_transform_edt, label
 from skimage.feature import peak_local_max
 from skimage.segmentation import watershed
+from tqdm import tqdm
 
 
 mpl.rcParams['figure.dpi'] = 600
@@ -58,12 +60,12 @@ def imread(filename):
     return cv.imread(filename)
 
 
-def grayscale_image(image):
+def grayscale_image(image, dst=None):
     nchannels = image.shape[2] if image.ndim > 2 else 1
     if nchannels == 4:
-        return cv.cvtColor(image, cv.COLOR_RGBA2GRAY)
+        return cv.cvtColor(image, cv.COLOR_RGBA2GRAY, dst=dst)
     elif nchannels > 1:
-        return cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+        return cv.cvtColor(image, cv.COLOR_RGB2GRAY, dst=dst)
     else:
         return image
 
@@ -76,10 +78,10 @@ def color_image(image):
         return image
 
 
-def float_image(image):
+def float_image(image, dst=None):
     if image.dtype.kind != 'f':
         maxval = 2 ** (8 * image.dtype.itemsize) - 1
-        return image / np.float32(maxval)
+        return np.divide(image, np.float32(maxval), out=dst, dtype=np.float32)
     else:
         return image
 
@@ -160,28 +162,55 @@ def round_significants(a, significant_digits):
 
 
 def calc_diff(source, multiplier=1):
-    dest = {}
-    last_value = None
-    for frame, value in source.items():
-        if last_value is not None:
-            dest[frame] = (value - last_value) * multiplier
-        last_value = value
-    return dest
+    frames = list(source.keys())
+    values = np.array(list(source.values()), dtype=float)
+    return dict(zip(frames[1:], ((values[1:] - values[:-1]) * multiplier).tolist()))
+
+
+def calc_path_dist(x, y):
+    # returns valid position mask, and distance to previous position where the last valid position is carried over
+    # invalid positions (distance 0); distance is nan up to and including the first valid position
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = (x >= 0) & (y >= 0) & np.isfinite(x) & np.isfinite(y)
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(len(valid)), -1)) if len(valid) > 0 else valid
+    dist = np.full(len(valid), np.nan)
+    if np.any(valid):
+        first = np.argmax(valid)
+        indices = last_valid[first:]
+        dist[first + 1:] = np.hypot(np.diff(x[indices]), np.diff(y[indices]))
+    return valid, dist
 
 
 def create_window0(frames, source, window_size):
-    # precise, but much slower
-    dest = {}
-    frames_window = deque(maxlen=window_size)
-    window = deque(maxlen=window_size)
-    mean_index = window_size // 2
-    for frame in frames:
-        frames_window.append(frame)
-        window.append(source.get(frame, np.nan))
-        if mean_index < len(frames_window):
-            mean_frame = frames_window[window_size // 2]
-            dest[mean_frame] = np.nanmean(window)
-    return dest
+    # precise
+    return create_windows(frames, {None: source}, [window_size])[None, window_size]
+
+
+def create_windows(frames, sources, window_sizes):
+    # precise (nan-aware, missing frames excluded) centred moving means of multiple sources and window sizes,
+    # using cumulative sums; returns {(source name, window size): {frame: mean}}
+    frames = list(frames)
+    n = len(frames)
+    values = np.array([[source.get(frame, np.nan) for frame in frames] for source in sources.values()],
+                      dtype=float).reshape(len(sources), n)
+    valid = ~np.isnan(values)
+    sums = np.zeros((len(sources), n + 1))
+    counts = np.zeros((len(sources), n + 1), dtype=int)
+    np.cumsum(np.where(valid, values, 0), axis=1, out=sums[:, 1:])
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+    windows = {}
+    for window_size in window_sizes:
+        mean_index = window_size // 2
+        # shorter than window: single mean of all values
+        starts = np.arange(max(n - window_size + 1, 1 if n > mean_index else 0))
+        ends = np.minimum(starts + window_size, n)
+        with np.errstate(invalid='ignore'):
+            means = (sums[:, ends] - sums[:, starts]) / (counts[:, ends] - counts[:, starts])
+        window_frames = frames[mean_index:mean_index + len(starts)]
+        for name, source_means in zip(sources, means):
+            windows[name, window_size] = dict(zip(window_frames, source_means.tolist()))
+    return windows
 
 
 def create_window(frames, source_dict, window_size):
@@ -221,8 +250,8 @@ def invert(image):
     return 1 - image
 
 
-def threshold(image, thres):
-    return cv.threshold(image, thres, 1, cv.THRESH_BINARY)[1]
+def threshold(image, thres, dst=None):
+    return cv.threshold(image, thres, 1, cv.THRESH_BINARY, dst=dst)[1]
 
 
 def create_kernel(size):
@@ -230,12 +259,12 @@ def create_kernel(size):
     return cv.getStructuringElement(cv.MORPH_ELLIPSE, (kernel_size, kernel_size))
 
 
-def erode(image, size):
-    return cv.erode(image, create_kernel(size))
+def erode(image, size, dst=None):
+    return cv.erode(image, create_kernel(size), dst=dst)
 
 
-def dilate(image, size):
-    return cv.dilate(image, create_kernel(size))
+def dilate(image, size, dst=None):
+    return cv.dilate(image, create_kernel(size), dst=dst)
 
 
 def dist_watershed_image(image):
@@ -335,44 +364,74 @@ def extract_filename_id_info(filename):
     return id_info
 
 
+class FilenameIndex:
+    # id and info per filename, parsed once
+    def __init__(self, filenames):
+        self.filenames = list(filenames)
+        self.id_infos = [extract_filename_id_info(filename) for filename in self.filenames]
+        self.id_counts = Counter(id_info[0] for id_info in self.id_infos)
+        self.info_counts = Counter(tuple(id_info[1:]) for id_info in self.id_infos)
+        self.ids = numeric_string_sort(list(self.id_counts))
+        infos = dict.fromkeys('_'.join(id_info[1:]) for id_info in self.id_infos)
+        self.infos = [info.split('_') for info in numeric_string_sort(list(infos))]
+
+    def get_groups(self):
+        # filenames per info, in order of first occurrence
+        groups = {}
+        for filename, id_info in zip(self.filenames, self.id_infos):
+            groups.setdefault('_'.join(id_info[1:]), []).append(filename)
+        return groups
+
+    def get_max_info_length(self):
+        return max([len(id_info) - 1 for id_info in self.id_infos], default=0)
+
+    def get_stats(self):
+        s = ''
+        s += f'#unique video ids: {len(self.infos)}\n'
+        s += f'#unique track ids: {len(self.ids)}\n'
+        for info in self.infos:
+            s += f'{info[0:-1]} - #tracks:\t{self.info_counts[tuple(info)]}\n'
+        for id in self.ids:
+            s += f'Track id {id} - #videos:\t{self.id_counts[id]}\n'
+        return s
+
+
 def find_all_filename_infos(filenames):
-    ids = set()
-    infos = set()
-    for filename in filenames:
-        id_info = extract_filename_id_info(filename)
-        ids.add(id_info[0])
-        infos.add('_'.join(id_info[1:]))
-    ids = numeric_string_sort(list(ids))
-    infos = numeric_string_sort(list(infos))
-    infos = [info.split('_') for info in infos]
-    return infos, ids
+    index = FilenameIndex(filenames)
+    return index.infos, index.ids
 
 
 def get_input_stats(input_files):
-    s = ''
-    infos, ids = find_all_filename_infos(input_files)
-    s += f'#unique video ids: {len(infos)}\n'
-    s += f'#unique track ids: {len(ids)}\n'
-    for info in infos:
-        n = 0
-        for input_file in input_files:
-            if extract_filename_id_info(input_file)[1:] == info:
-                n += 1
-        s += f'{info[0:-1]} - #tracks:\t{n}\n'
-
-    for id in ids:
-        n = 0
-        for input_file in input_files:
-            if extract_filename_id_info(input_file)[0] == id:
-                n += 1
-        s += f'Track id {id} - #videos:\t{n}\n'
-    return s
+    return FilenameIndex(input_files).get_stats()
 
 
 def numeric_string_sort(items):
     return sorted(items, key=lambda item: list(map(int, re.findall(r'\d+', item))))
 
 
+def parallel_map(function, items, workers=None, initializer=None, initargs=(), progress=False, pool=None):
+    # process pool map (function needs to be defined at module level); workers: None: all cores, 1: sequential
+    # initializer: called with initargs once per process, e.g. to share data between items
+    # pool: existing process pool to reuse for repeated calls (instead of initializer)
+    # items are distributed in chunks, results are in order of items
+    items = list(items)
+    if workers == 1 or len(items) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [function(item) for item in tqdm(items, disable=not progress)]
+    if pool is not None:
+        return pool_map(pool, function, items, workers, progress)
+    with multiprocessing.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        return pool_map(pool, function, items, workers, progress)
+
+
+def pool_map(pool, function, items, workers, progress):
+    if progress:
+        chunksize = max(math.ceil(len(items) / ((workers or os.cpu_count()) * 4)), 1)
+        return list(tqdm(pool.imap(function, items, chunksize), total=len(items)))
+    return pool.map(function, items)
+
+
 def get_frames_number(value, fps):
     multipliers = [1, 60, 60, 24]
     nframes = value
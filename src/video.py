@@ -5,8 +5,10 @@ from tqdm import tqdm
 from src.util import get_filetitle_replace, create_color_table, color_float_to_cv
 
 
-def video_iterator(video_infiles, start=0, end=None, interval=1):
+def video_iterator(video_infiles, start=0, end=None, interval=1, reuse_frame=False):
     # TODO: create class, allowing next() (iteration) and seek()
+    # reuse_frame: decode into the same frame buffer; each frame is only valid until the next iteration
+    frame_buffer = None
     for video_infile in tqdm(video_infiles):
         vidcap = cv.VideoCapture(video_infile)
         if start > 0:
@@ -18,7 +20,9 @@ def video_iterator(video_infiles, start=0, end=None, interval=1):
         while ok:
             ok = vidcap.isOpened()
             if ok:
-                ok, video_frame = vidcap.read()
+                ok, video_frame = vidcap.read(frame_buffer)
+                if reuse_frame:
+                    frame_buffer = video_frame
                 if framei % interval == 0:
                     if ok:
                         yield video_frame
@@ -30,6 +34,27 @@ def video_iterator(video_infiles, start=0, end=None, interval=1):
         vidcap.release()
 
 
+def video_sample_iterator(video_infiles, nsamples, start=0, end=None):
+    # sparse sampling of frames evenly distributed over [start, end) of the (concatenated) videos, using seek
+    nframes_list = [video_info(video_infile)[2] for video_infile in video_infiles]
+    total_frames = sum(nframes_list)
+    if end is None or end > total_frames:
+        end = total_frames
+    frames = np.unique(np.linspace(start, end - 1, nsamples).astype(int))
+    offset = 0
+    for video_infile, nframes in zip(video_infiles, nframes_list):
+        file_frames = frames[(frames >= offset) & (frames < offset + nframes)] - offset
+        if len(file_frames) > 0:
+            vidcap = cv.VideoCapture(video_infile)
+            for framei in file_frames:
+                vidcap.set(cv.CAP_PROP_POS_FRAMES, framei)
+                ok, video_frame = vidcap.read()
+                if ok:
+                    yield video_frame
+            vidcap.release()
+        offset += nframes
+
+
 def annotate_videos(video_infiles, video_outfile, datas, params):
     interval = params.get('frame_interval', 1)
     start = params.get('frame_start', 0)
@@ -0,0 +1,90 @@
+import cv2 as cv
+import numpy as np
+
+from src.pipeline.BackgroundModel import BackgroundModel
+from src.pipeline.ImageProcessing import ImageProcessing
+from src.segmentation import float_image, grayscale_image
+
+
+def test_running_median():
+    # converges to static background in steps of update_rate, despite occasional objects
+    rng = np.random.default_rng(0)
+    background = rng.uniform(0.2, 0.8, (20, 30)).astype(np.float32)
+    model = BackgroundModel({'method': 'median', 'update_rate': 0.01})
+    model.update(np.full(background.shape, 0.5, dtype=np.float32))
+    for samplei in range(100):
+        image = background.copy()
+        if samplei % 5 == 0:
+            image[5:10, 5:10] = 0
+        model.update(image)
+    assert model.nsamples == 101
+    assert np.max(np.abs(model.background - background)) <= 0.01 + 1e-6
+    # step of update_rate in direction of the sample, independent of the difference
+    last_background = model.background.copy()
+    model.update(last_background + np.where(background > 0.5, 1, -0.1).astype(np.float32))
+    assert np.allclose(model.background - last_background, np.where(background > 0.5, 0.01, -0.01))
+
+
+def test_running_mean():
+    # cumulative mean while the model is young, then exponential mean with update_rate
+    model = BackgroundModel({'method': 'mean', 'update_rate': 0.1})
+    for value in [0, 1, 2, 3]:
+        model.update(np.full((2, 2), value, dtype=np.float32))
+    assert np.allclose(model.background, 1.5)
+    for _ in range(6):
+        model.update(np.full((2, 2), 4, dtype=np.float32))
+    assert np.allclose(model.background, 3)
+    for _ in range(10):
+        model.update(np.full((2, 2), 4, dtype=np.float32))
+    assert np.allclose(model.background, 4 - 0.9 ** 10)
+
+
+def test_sample_interval():
+    model = BackgroundModel({'sample_interval': 3})
+    assert [frame_count for frame_count in range(10) if model.check_update(frame_count)] == [0, 3, 6, 9]
+
+
+def test_region_update():
+    # region updates followed by end_update equal a single update of the full image
+    rng = np.random.default_rng(0)
+    images = rng.uniform(0, 1, (3, 10, 20)).astype(np.float32)
+    for method in ['median', 'mean']:
+        model = BackgroundModel({'method': method, 'update_rate': 0.1})
+        region_model = BackgroundModel({'method': method, 'update_rate': 0.1})
+        region_model.init_background(images[0])
+        regions = [(slice(0, 10), slice(0, 8)), (slice(0, 10), slice(8, 20))]
+        for image in images:
+            model.update(image)
+            for region in regions:
+                region_model.update(image[region], region)
+            region_model.end_update()
+        assert region_model.nsamples == model.nsamples == 3
+        assert np.allclose(region_model.background, model.background)
+
+
+def test_precompute_background(tmp_path):
+    # exact median of the sparsely sampled (preprocessed) frames
+    filename = str(tmp_path / 'video.avi')
+    rng = np.random.default_rng(0)
+    writer = cv.VideoWriter(filename, cv.VideoWriter.fourcc(*'MJPG'), 10, (64, 48))
+    for _ in range(20):
+        writer.write(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    writer.release()
+
+    params = {'operations': ['grayscale_image', 'subtract_background'],
+              'background_model': {'precompute_samples': 4}}
+    processing = ImageProcessing(params, '', [filename], None, None)
+    processing.precompute_background([filename])
+
+    vidcap = cv.VideoCapture(filename)
+    frames = []
+    while True:
+        ok, frame = vidcap.read()
+        if not ok:
+            break
+        frames.append(grayscale_image(float_image(frame)))
+    vidcap.release()
+    assert len(frames) == 20
+    sampled_frames = [frames[framei] for framei in [0, 6, 12, 19]]
+    assert processing.background_model.nsamples == 4
+    assert np.allclose(processing.background_model.background, np.median(sampled_frames, 0))
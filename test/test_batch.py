@@ -0,0 +1,53 @@
+import yaml
+
+from src.batch import create_tasks, read_manifest, run_batch, create_slurm_script
+
+
+def test_batch(tmp_path):
+    params_files = []
+    for name, operations in [('ok', []), ('failing', [{'unknown_operation': {}}])]:
+        params_file = str(tmp_path / f'{name}.yml')
+        with open(params_file, 'w') as file:
+            yaml.safe_dump({'general': {'base_dir': ''}, 'operations': operations}, file)
+        params_files.append(params_file)
+    for dataset in ['dataset1', 'dataset2']:
+        (tmp_path / dataset).mkdir()
+    tasks = create_tasks(params_files, [str(tmp_path / 'dataset*')])
+    assert len(tasks) == 4
+    assert tasks[1]['base_dir'] == str(tmp_path / 'dataset2')
+
+    manifest = str(tmp_path / 'manifest.jsonl')
+    entries = run_batch(tasks, manifest, workers=1, shard=0, nshards=2)
+    assert [entry['status'] for entry in entries] == ['done', 'failed']
+    entries = run_batch(tasks, manifest, workers=1)
+    assert [entry['task'] for entry in entries] == [tasks[1]['id'], tasks[2]['id'], tasks[3]['id']]
+    status = read_manifest(manifest)
+    assert [status[task['id']] for task in tasks] == ['done', 'done', 'failed', 'failed']
+
+    script = str(tmp_path / 'batch.sh')
+    create_slurm_script(script, ['--params', params_files[0]], 4)
+    with open(script) as file:
+        content = file.read()
+    assert '#SBATCH --array=0-3' in content
+    assert '--shard=$SLURM_ARRAY_TASK_ID' in content
+
+
+def test_batch_parallel_operations(tmp_path):
+    # tasks running in parallel, each reading its track files in parallel processes
+    for dataset in ['dataset1', 'dataset2']:
+        (tmp_path / dataset / 'tracks').mkdir(parents=True)
+        for track_id in range(2):
+            with open(tmp_path / dataset / 'tracks' / f'exp_video_{track_id}.csv', 'w') as file:
+                file.write('track_label,frame,time,x,y,angle,v_projection,length_major1,length_minor1\n')
+                for frame in range(20):
+                    file.write(f'{track_id},{frame},{frame / 10},{frame},{track_id},{frame},1,10,3\n')
+    general = {'base_dir': '', 'input': 'tracks/*.csv', 'video_input': '*.mp4', 'fps': 10, 'window_size': '1s',
+               'workers': 2}
+    operations = [{'extract_features': [{'profiles': {'features': ['v'], 'output': 'profile_{feature}.csv'}}]}]
+    params_file = str(tmp_path / 'params.yml')
+    with open(params_file, 'w') as file:
+        yaml.safe_dump({'general': general, 'operations': operations}, file)
+    tasks = create_tasks([params_file], [str(tmp_path / 'dataset*')])
+    entries = run_batch(tasks, str(tmp_path / 'manifest.jsonl'), workers=2)
+    assert [entry['status'] for entry in entries] == ['done', 'done']
+    assert (tmp_path / 'dataset2' / 'profile_v.csv').exists()
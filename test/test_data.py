@@ -0,0 +1,156 @@
+import math
+import numpy as np
+
+from src.Data import Data, calc_loghists, create_datas, read_datas
+from src.pipeline.Relabeller import Relabeller
+from src.util import create_windows, create_window0
+
+
+def create_data(x, y, angle=None):
+    frames = list(range(len(x)))
+    data = {'frame': dict(zip(frames, frames)), 'time': {frame: frame / 10 for frame in frames},
+            'x': dict(zip(frames, x)), 'y': dict(zip(frames, y)), 'track_label': {frame: 1 for frame in frames}}
+    if angle is not None:
+        data['angle'] = dict(zip(frames, angle))
+    return data
+
+
+def test_calc_basic():
+    # gaps: invalid positions before first valid position have no distance, later gaps keep last position
+    x = [np.nan, 0, 3, np.nan, -1, 3, 6]
+    y = [np.nan, 0, 4, 4, 4, 8, 8]
+    angle = [0, 10, 30, 60, 60, 50, 40]
+    data = Data(create_data(x, y, angle), id='1', fps=10, pixel_size=2)
+    assert list(data.position) == [1, 2, 5, 6]
+    assert data.position[2] == (6, 8)
+    # distance is scaled by pixel size on top of the scaled positions
+    assert list(data.data['dist']) == [2, 3, 4, 5, 6]
+    assert np.allclose(list(data.data['dist'].values()), [20, 0, 0, 16, 12])
+    assert np.allclose(list(data.data['dist_tot'].values()), [20, 20, 20, 36, 48])
+    assert np.allclose(list(data.data['dist_origin'].values()), [0, 10, math.dist((6, 16), (0, 0)), 20])
+    assert np.allclose(list(data.data['v'].values()), [200, 0, 0, 160, 120])
+    assert list(data.data['a']) == [3, 4, 5, 6]
+    assert np.allclose(list(data.data['a'].values()), [-2000, 0, 1600, -400])
+    assert np.allclose(list(data.data['v_angle'].values()), [100, 200, 300, 0, -100, -100])
+    assert np.allclose(list(data.data['a_angle'].values()), [1000, 1000, -3000, -1000, 0])
+
+    data = Data(create_data([np.nan, np.nan], [1, 2]), id='1')
+    assert data.position == {}
+    assert data.data['dist'] == {}
+    assert data.data['dist_origin'] == {}
+
+
+def test_calc_loghists():
+    # upper edge included in last bin; zero and values below range discarded; normalised by number of frames
+    hists, bin_edges = calc_loghists([[0.01, 1, -1, 100, 0, 0.001, np.nan], [], [1e6]], [10, 1, 2], -2, 2)
+    assert len(bin_edges) == 21
+    assert np.isclose(bin_edges[10], 1)
+    expected = np.zeros((3, 20))
+    expected[0, 0] = 0.1
+    expected[0, 10] = 0.2
+    expected[0, 19] = 0.1
+    expected[2, 19] = 0.5
+    assert np.allclose(hists, expected)
+
+
+def test_classify_activity():
+    data = create_data([1] * 6, [1] * 6, [0, 0, 0, 36, 36, 36])
+    data['v_projection'] = dict(enumerate([0, 4, 1, 1, 0.1, 0]))
+    data['length_major1'] = dict(enumerate([1, 1, 1, 1, 1.5, 1.5]))
+    data['length_minor1'] = dict(enumerate([1] * 6))
+    data = Data(data, id='1')
+    data.meanl = 1
+    data.meanw = 1
+    assert data.classify_activity('movement_type') == {'': 2, 'brownian': 1, 'levi': 1, 'ballistic': 1}
+    # sources paired by position: angle velocity starts one frame later
+    assert data.activity == {0: '', 1: 'ballistic', 2: 'brownian', 3: 'levi', 4: ''}
+    assert data.classify_activity('movement') == {'': 1, 'appendages': 1, 'moving': 3}
+    assert data.activity[4] == 'appendages'
+    # cached per output type
+    assert data.classify_activity('movement_type') is data.activities['movement_type'][1]
+    assert data.get_activity_time('levi') == data.dtime
+
+
+def test_lazy_features():
+    data = Data(create_data([0, 1, 2, 3], [0, 0, 0, 0]), id='1', fps=2, window_size='2')
+    assert 'v' not in list(data.data)
+    assert 'v1' in data.data and 'v_angle' not in data.data
+    assert data.data.get('v_angle') is None
+    assert list(data.data['v1'].values()) == [1, 2, 2]
+    # dependencies calculated and stored once
+    assert {'dist', 'v', 'v1'}.issubset(data.data.keys())
+    assert data.data['v'] is data.data['v']
+    data.calc_means()
+    assert data.meanx == 1.5
+
+
+def test_create_datas(tmp_path):
+    filenames = []
+    for filei in range(3):
+        filename = str(tmp_path / f'tracks_{filei}.csv')
+        with open(filename, 'w') as file:
+            file.write('track_label,frame,time,x,y\n')
+            for frame in range(5):
+                for track_id in range(2):
+                    file.write(f'{track_id},{frame},{frame / 10},{filei + frame},{track_id * 10 + frame / 2}\n')
+        filenames.append(filename)
+    datas = create_datas(filenames, workers=1)
+    datas_parallel = create_datas(filenames, workers=2)
+    assert [(data.filename, data.id) for data in datas_parallel] == [(data.filename, data.id) for data in datas]
+    assert len(datas) == 6
+    for data, data_parallel in zip(datas, datas_parallel):
+        assert data_parallel.data == data.data
+        assert data_parallel.data['v'] == data.data['v']
+    assert datas[2].data['x'] == {frame: 1 + frame for frame in range(5)}
+    assert read_datas(filenames[1:], workers=2)[0]['0'].data['y'][4] == 2
+
+
+def test_create_windows():
+    frames = [0, 1, 2, 3, 4, 5]
+    source = {0: 1, 1: 3, 2: np.nan, 4: 5, 5: 7}
+    windows = create_windows(frames, {'a': source, 'b': {frame: 1 for frame in frames}}, [3, 10])
+    # centred, missing / nan values excluded, no padding at the ends
+    assert windows['a', 3] == {1: 2, 2: 3, 3: 5, 4: 6}
+    assert windows['b', 3] == {1: 1, 2: 1, 3: 1, 4: 1}
+    # shorter than window: single mean
+    assert windows['a', 10] == {5: 4}
+    assert create_window0(frames, source, 4) == {2: 2, 3: 4, 4: 6}
+
+
+def test_window_features():
+    x = list(range(10))
+    data = Data(create_data(x, [0] * 10), id='1', fps=1, window_size='3', window_method='precise',
+                window_sizes=['5s'])
+    assert data.window_frames == 3
+    assert 'v_5s' in data.data and 'v_7' not in data.data
+    data.calc_windows()
+    assert data.data['v1'] == {frame: 1 for frame in range(1, 9)}
+    assert data.data['dist_5s'] == {frame: 1 for frame in range(2, 8)}
+    data = Data(create_data(x, [0] * 10), id='1', fps=1, window_size='3')
+    # padded with zero at start
+    assert data.data['v1'][1] == 2 / 3
+
+
+def test_export_data(tmp_path):
+    # exported columns do not depend on the features used before
+    columns = ['track_label', 'frame', 'time', 'x', 'y', 'angle']
+    filenames = []
+    for track_id in range(2):
+        filename = str(tmp_path / f'tracks_{track_id}.csv')
+        with open(filename, 'w') as file:
+            file.write(','.join(columns) + '\n')
+            for frame in range(5):
+                file.write(f'{track_id},{frame},{frame / 10},{frame * (track_id + 1)},0,{frame}\n')
+        filenames.append(filename)
+    output_dir = tmp_path / 'relabel'
+    output_dir.mkdir()
+    Relabeller({'method': 'sort v'}).relabel_sort(filenames, str(output_dir), None)
+    expected_header = ','.join(columns + ['dist', 'dist_tot', 'dist_origin', 'v', 'a', 'v_angle', 'a_angle'])
+    assert len(list(output_dir.iterdir())) == 2
+    for filename in output_dir.iterdir():
+        with open(filename) as file:
+            assert file.readline().strip() == expected_header
+
+    data = create_datas(filenames[:1])[0]
+    assert list(data.get_frame_data(0)) == expected_header.split(',')
+    assert data.get_frame_data(0)['dist'] == {0: None}
@@ -0,0 +1,108 @@
+import numpy as np
+
+from src.Data import Data, create_datas
+from src.parameters import PROFILE_HIST_BINS
+from src.pipeline import extract_features
+from src.util import FilenameIndex, get_input_files
+
+
+def create_tracks(path):
+    rng = np.random.default_rng(0)
+    path.mkdir()
+    for video in ['videoA', 'videoB']:
+        for track_id in range(3 if video == 'videoA' else 2):
+            with open(path / f'exp_{video}_{track_id}.csv', 'w') as file:
+                file.write('track_label,frame,time,x,y,angle,v_projection,length_major1,length_minor1,is_merged\n')
+                x, y = 100 + np.cumsum(rng.normal(0, 2, (2, 100)), axis=1)
+                for frame in range(100 - track_id * 10):
+                    file.write(f'{track_id},{frame},{frame / 10},{x[frame]},{y[frame]},{rng.uniform(-180, 180)},'
+                               f'{rng.normal(0, 5)},{10 + rng.normal(0, 0.1)},{3 + rng.normal(0, 0.05)},0\n')
+
+
+def run_extract_features(base_dir, stream, workers=1):
+    general = {'base_dir': str(base_dir), 'input': 'tracks/*.csv', 'video_input': '*.mp4', 'fps': 10,
+               'pixel_size': 1, 'window_size': '1s', 'add_missing': True, 'stream_features': stream, 'workers': workers}
+    output = 'stream' if stream else 'all'
+    params = [{'profiles': {'features': ['v'], 'output': output + '_profile_{feature}.csv'}},
+              {'features': {'features': ['v_percentiles'], 'output': output + '_features.csv'}},
+              {'activity': {'features': ['movement'], 'output': output + '_{feature}.csv'}}]
+    extract_features.run({'general': general, 'operations': [{'extract_features': params}]}, params)
+    return {name: (base_dir / f'{output}_{name}.csv').read_text().splitlines()
+            for name in ['profile_v', 'features', 'movement']}
+
+
+def test_stream_features(tmp_path):
+    create_tracks(tmp_path / 'tracks')
+    outputs = run_extract_features(tmp_path, False)
+    # files read in shared process pool
+    stream_outputs = run_extract_features(tmp_path, True, workers=2)
+    for name, lines in outputs.items():
+        # missing track added per data set
+        assert len(lines) == 1 + 6
+        assert lines[0] == stream_outputs[name][0]
+        assert sorted(lines[1:]) == sorted(stream_outputs[name][1:])
+    assert '2,exp,videoB' in stream_outputs['movement']
+
+
+def test_features_without_data(tmp_path):
+    # header independent of data set without any tracks
+    datas = extract_features.add_missing_data([], [['exp', 'empty']], ['0'])
+    params = [{'profiles': {'features': ['v'], 'output': 'profile_{feature}.csv'}},
+              {'features': {'features': ['v_percentiles'], 'output': 'features.csv'}}]
+    csv_files = {}
+    extract_features.extract_feature_sets(datas, params, {'base_dir': str(tmp_path)}, ['ID', 'info1', 'info2'], 2,
+                                          None, csv_files)
+    for csvfile, _ in csv_files.values():
+        csvfile.close()
+    lines = (tmp_path / 'profile_v.csv').read_text().splitlines()
+    assert len(lines[0].split(',')) == 3 + PROFILE_HIST_BINS + 1
+    assert lines[1:] == ['0,exp,empty']
+    lines = (tmp_path / 'features.csv').read_text().splitlines()
+    assert lines[0] == 'ID,info1,info2,v 25% percentile,v 50% percentile,v 75% percentile'
+    assert lines[1:] == ['0,exp,empty']
+
+
+def test_filename_index():
+    filenames = ['exp_video2_0.csv', 'exp_video10_1.csv', 'exp_video2_1.csv', 'exp_video2_fish3.csv']
+    index = FilenameIndex(filenames)
+    assert index.ids == ['0', '1', '3']
+    assert index.infos == [['exp', 'video2'], ['exp', 'video2', 'fish'], ['exp', 'video10']]
+    assert index.get_groups() == {'exp_video2': ['exp_video2_0.csv', 'exp_video2_1.csv'],
+                                  'exp_video10': ['exp_video10_1.csv'], 'exp_video2_fish': ['exp_video2_fish3.csv']}
+    assert index.get_max_info_length() == 3
+    assert "['exp'] - #tracks:\t2" in index.get_stats()
+    assert 'Track id 1 - #videos:\t2' in index.get_stats()
+
+    datas = [Data(info=['exp', 'video2'], id='0')]
+    datas = extract_features.add_missing_data(datas, index.infos[:1], index.ids)
+    assert [data.id_info for data in datas] == [['0', 'exp', 'video2'], ['1', 'exp', 'video2'], ['3', 'exp', 'video2']]
+
+
+def test_extract_events(tmp_path):
+    create_tracks(tmp_path / 'tracks')
+    params = {'type': 'contact', 'features': ['n', 'time'], 'contact_distance': 1000, 'activity_frame_range': 3}
+    outputs = []
+    for workers in [1, 2]:
+        general = {'base_dir': str(tmp_path), 'input': 'tracks/*.csv', 'video_input': '*.mp4', 'fps': 10,
+                   'pixel_size': 1, 'window_size': '1s', 'workers': workers}
+        datas = create_datas(get_input_files(general, {}, 'input'))
+        for data in datas:
+            data.calc_means()
+            data.classify_activity('movement_type')
+        outputs.append(extract_features.extract_events(datas, ['n', 'time'], params, general))
+    # data sets in order of first occurrence
+    assert list(outputs[0]) == list(outputs[1]) == list(dict.fromkeys('_'.join(data.info) for data in datas))
+    assert outputs[0] == outputs[1]
+    assert outputs[0]['exp_videoA'][0] == 2
+
+
+def test_extract_events_workers(monkeypatch):
+    # path events writing shared per-frame files are processed sequentially
+    used_workers = []
+    monkeypatch.setattr(extract_features, 'parallel_map',
+                        lambda function, jobs, workers, progress: used_workers.append(workers) or [None] * len(jobs))
+    datas = [Data(info=['exp', video], id='0') for video in ['videoA', 'videoB']]
+    for params in [{}, {'output': 'paths_{frame}.csv'}, {'image_output': 'paths_{frame}.png'}]:
+        extract_features.extract_events(datas, ['n'], {'type': 'path', **params}, {'workers': 2})
+    extract_features.extract_events(datas, ['n'], {'type': 'contact', 'output': 'contacts.csv'}, {'workers': 2})
+    assert used_workers == [2, 1, 1, 2]
@@ -0,0 +1,62 @@
+import time
+import cv2 as cv
+import numpy as np
+
+from src.segmentation import create_gabor_filters, gabor_filtering, gabor_filtering_fft
+
+
+def create_test_image(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.random(shape, dtype=np.float32)
+    return cv.GaussianBlur(image, (0, 0), 2)
+
+
+def test_gabor_filtering_fft():
+    filters = create_gabor_filters()
+    image = create_test_image((300, 400))
+    expected = gabor_filtering(image, filters)
+    for tile_size in [None, 128, 256]:
+        result = gabor_filtering_fft(image, filters, tile_size)
+        assert result.shape == expected.shape and result.dtype == expected.dtype
+        assert np.allclose(result, expected, atol=1e-5)
+
+
+def test_gabor_filtering_fft_uint8():
+    filters = create_gabor_filters()
+    image = (create_test_image((200, 200)) * 255).astype(np.uint8)
+    expected = gabor_filtering(image, filters)
+    kernel_spectra = {}
+    for tile_size in [None, 64]:
+        result = gabor_filtering_fft(image, filters, tile_size, kernel_spectra=kernel_spectra)
+        assert result.dtype == np.uint8 and result.shape == expected.shape
+        # rounding of values halfway between integers may differ
+        assert np.max(np.abs(result.astype(int) - expected)) <= 1
+        assert np.mean(result == expected) > 0.99
+
+
+def benchmark(shape, repeats=3):
+    filters = create_gabor_filters()
+    filters_half = create_gabor_filters(0.5)
+    image = create_test_image(shape)
+    image_half = cv.resize(image, None, fx=0.5, fy=0.5, interpolation=cv.INTER_AREA)
+    kernel_spectra = {}
+    tests = {
+        'direct': lambda: gabor_filtering(image, filters),
+        'fft': lambda: gabor_filtering_fft(image, filters, kernel_spectra=kernel_spectra),
+        'fft scale 0.5': lambda: gabor_filtering_fft(image_half, filters_half, kernel_spectra={}),
+    }
+    times = {}
+    for label, function in tests.items():
+        function()  # warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        times[label] = (time.perf_counter() - start) / repeats
+    for label, elapsed in times.items():
+        print(f'{shape[1]}x{shape[0]} {label}: {elapsed:.3f}s (speedup {times["direct"] / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+    test_gabor_filtering_fft()
+    benchmark((1080, 1920))
+    benchmark((2160, 3840))
@@ -0,0 +1,72 @@
+import cv2 as cv
+import numpy as np
+
+from src.pipeline.ImageProcessing import ImageProcessing
+
+
+class ColumnsWriter:
+    def __init__(self):
+        self.data = {}
+
+    def write_columns(self, data):
+        for key, values in data.items():
+            self.data.setdefault(key, []).extend(values)
+
+
+def create_frame(shape=(600, 800), n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.full(shape + (3,), 200, dtype=np.uint8)
+    for _ in range(n):
+        center = (int(rng.uniform(0, shape[1])), int(rng.uniform(0, shape[0])))
+        axes = (int(rng.uniform(8, 20)), int(rng.uniform(4, 8)))
+        cv.ellipse(image, center, axes, rng.uniform(0, 180), 0, 360, (40, 40, 40), thickness=cv.FILLED)
+    return image
+
+
+def detect_frame(image, params):
+    return detect_frames([image], params)[0]
+
+
+def detect_frames(images, params):
+    params = {'operations': ['grayscale_image', 'invert', 'threshold(0.5)', 'erode(1)', 'dilate(1)', 'detect(5)']}\
+        | params
+    processing = ImageProcessing(params, '', ['none.mp4'], None, None)
+    all_detections = []
+    for frame_count, image in enumerate(images):
+        writer = ColumnsWriter()
+        processing.data_writers = [writer]
+        processing.framei = processing.frame_count = frame_count
+        processing.process_image(image)
+        if writer.data:
+            order = np.lexsort((writer.data['y_body'], writer.data['x_body']))
+            writer.data = {key: np.array(values)[order] for key, values in writer.data.items()}
+        all_detections.append(writer.data)
+    return all_detections
+
+
+def test_tiled_detection():
+    image = create_frame()
+    expected = detect_frame(image, {})
+    for buffered in [False, True]:
+        detections = detect_frame(image, {'tile_size': 256, 'tile_overlap': 48, 'buffered': buffered})
+        assert len(np.unique(detections['id'])) == len(detections['id'])
+        for key in ['x_body', 'y_body', 'area', 'length_major', 'length_minor', 'angle']:
+            assert np.allclose(detections[key], expected[key])
+
+
+def test_tiled_background_model():
+    # running background model initialised from first frame: tiles equal to full frame
+    images = [create_frame(seed=seed) for seed in range(3)]
+    for method in ['median', 'mean']:
+        params = {'operations': ['grayscale_image', 'subtract_background', 'threshold(0.3)', 'erode(1)', 'dilate(1)',
+                                 'detect(5)'],
+                  'background_model': {'method': method, 'update_rate': 0.05}}
+        expected = detect_frames(images, params)
+        assert expected[0] == {}
+        assert len(expected[1]['id']) > 0
+        detections = detect_frames(images, params | {'tile_size': 256, 'tile_overlap': 48})
+        assert detections[0] == {}
+        for frame_detections, frame_expected in zip(detections[1:], expected[1:]):
+            assert len(frame_detections['id']) == len(frame_expected['id'])
+            for key in ['x_body', 'y_body', 'area']:
+                assert np.allclose(frame_detections[key], frame_expected[key])
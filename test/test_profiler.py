@@ -0,0 +1,26 @@
+import json
+
+from src.Profiler import Profiler
+
+
+def test_profiler(tmp_path):
+    filename = str(tmp_path / 'profile.jsonl')
+    profiler = Profiler(True, filename, interval=2)
+    profiler.start()
+    for framei in range(5):
+        profiler.lap('read')
+        profiler.lap('track')
+        profiler.end_frame({'detections': 10}, {'active_tracks': framei})
+    profiler.close({'active_tracks': 5})
+    with open(filename) as file:
+        reports = [json.loads(line) for line in file]
+    assert [report['frames'] for report in reports] == [2, 4, 5]
+    assert [report['active_tracks'] for report in reports] == [1, 3, 5]
+    assert set(reports[0]['stages']) == {'read', 'track'}
+    assert reports[0]['detections_per_s'] > 0
+
+    profiler = Profiler(False, str(tmp_path / 'disabled.jsonl'))
+    profiler.lap('read')
+    profiler.end_frame({'detections': 10}, {})
+    profiler.close()
+    assert not (tmp_path / 'disabled.jsonl').exists()
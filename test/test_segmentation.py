@@ -0,0 +1,63 @@
+import cv2 as cv
+import numpy as np
+
+from src.segmentation import detect_components, split_contour_gamma, split_contour_levels
+from src.util import get_image_moments, get_moments_centre, get_moments_angle, get_contours, get_area, threshold
+
+
+def create_blobs_image(shape=(200, 300)):
+    image = np.zeros(shape, dtype=np.float32)
+    cv.ellipse(image, (50, 50), (20, 8), 30, 0, 360, 1, thickness=cv.FILLED)
+    cv.ellipse(image, (150, 120), (25, 10), -60, 0, 360, 1, thickness=cv.FILLED)
+    cv.rectangle(image, (220, 20), (259, 29), 1, thickness=cv.FILLED)
+    cv.circle(image, (250, 170), 1, 1, thickness=cv.FILLED)
+    return image
+
+
+def test_detect_components():
+    image = create_blobs_image()
+    detections = detect_components(image, min_area=10)
+    assert len(detections['id']) == 3
+
+    nlabels, labels = cv.connectedComponents(image.astype(np.uint8), connectivity=8)
+    for label in range(1, nlabels):
+        mask = (labels == label)
+        if np.count_nonzero(mask) < 10:
+            continue
+        moments = get_image_moments(mask)
+        x, y = get_moments_centre(moments)
+        index = np.argmin(np.hypot(detections['x_body'] - x, detections['y_body'] - y))
+        assert np.isclose(detections['x_body'][index], x)
+        assert np.isclose(detections['y_body'][index], y)
+        assert detections['area'][index] == moments['m00']
+        assert np.isclose(detections['angle'][index], get_moments_angle(moments))
+
+    # rectangle of 40 x 10 pixels
+    index = np.argmin(np.abs(detections['x_body'] - 239.5))
+    assert np.isclose(detections['length_major'][index], 40)
+    assert np.isclose(detections['length_minor'][index], 10)
+
+
+def create_merged_image(rng, shape=(120, 160)):
+    image = np.zeros(shape, dtype=np.float32)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    n = rng.integers(2, 5)
+    for _ in range(n):
+        cx, cy, size, intensity = rng.uniform(50, 110), rng.uniform(40, 80), rng.uniform(6, 12), rng.uniform(0.3, 1)
+        image = np.maximum(image, intensity * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * size ** 2)))
+    image += rng.normal(0, 0.02, shape)
+    return np.clip(image, 0, 1).astype(np.float32), n
+
+
+def test_split_contour_levels():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        image, n = create_merged_image(rng)
+        contours = [contour for contour in get_contours(threshold(image, 0.1)) if get_area(contour) >= 20]
+        for contour in contours:
+            for n1 in [n, 100]:
+                expected = split_contour_gamma(contour, n1, 0, image)
+                result = split_contour_levels(contour, n1, 0, image)
+                assert len(result) == len(expected)
+                for contour1, expected_contour in zip(result, expected):
+                    assert np.array_equal(contour1, expected_contour)
@@ -0,0 +1,262 @@
+import csv
+import json
+import numpy as np
+import pyarrow.feather
+import pytest
+
+from src.file.CsvStreamWriter import CsvStreamWriter
+from src.file.FeatherStreamWriter import FeatherStreamWriter
+from src.pipeline import sweep_tracking
+from src.pipeline.Tracker import Tracker, frame_columns_iterator
+from src.pipeline.TrackingStats import QuantileSketch
+from src.pipeline.TrackState import TrackState
+
+
+def create_detections(nframes=100, n=20, seed=0, size=500):
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(0, size, (n, 2))
+    velocities = rng.normal(0, 1, (n, 2))
+    frames = []
+    for framei in range(nframes):
+        positions = positions + velocities
+        detections = []
+        for index, position in enumerate(positions):
+            x, y = position + rng.normal(0, 0.5, 2)
+            detections.append({'frame': framei, 'id': index, 'x_head': x + 5, 'y_head': y,
+                               'x_body': x, 'y_body': y, 'x_tail': x - 5, 'y_tail': y})
+        frames.append(detections)
+    return frames
+
+
+def write_detections(filename, frames, shuffle=False):
+    # shuffle: random order of detections within frames
+    rng = np.random.default_rng(0)
+    data_writer = FeatherStreamWriter(str(filename), 50)
+    for detections in frames:
+        for index in rng.permutation(len(detections)) if shuffle else range(len(detections)):
+            data_writer.write(detections[index])
+    data_writer.close()
+    return str(filename)
+
+
+def rows_to_columns(rows):
+    return {key: [row.get(key) for row in rows] for key in rows[0]} if rows else {}
+
+
+def track_detections(frames, params):
+    params = {'max_individuals': 100, 'move_distance': 4, 'max_move_distance': 10, 'max_inactive': 10} | params
+    tracker = Tracker(params, '', [], ['none.mp4'], None, None)
+    results = []
+    for framei, detections in enumerate(frames):
+        tracker.track_frame(framei, tracker.calc_frame_features(rows_to_columns(detections)))
+        tracks = tracker.tracks
+        results.append({tracks.values[slot]['id']: track_id
+                        for track_id, slot in tracks.items() if tracks.assigned[slot]})
+    return tracker, results
+
+
+def test_track_identities():
+    frames = create_detections()
+    for assignment in ['greedy', 'optimal']:
+        tracker, results = track_detections(frames, {'assignment': assignment})
+        assert tracker.next_id == 20
+        assert all(result == results[0] for result in results)
+
+
+def test_optimal_assignment():
+    # greedy assigns the closest pair first, leaving the second detection outside the gate of the other track
+    frames = [[{'frame': 0, 'id': 0, 'x_head': 0, 'y_head': 0, 'x_body': 0, 'y_body': 0, 'x_tail': 0, 'y_tail': 0},
+               {'frame': 0, 'id': 1, 'x_head': 4, 'y_head': 0, 'x_body': 4, 'y_body': 0, 'x_tail': 4, 'y_tail': 0}],
+              [{'frame': 1, 'id': 0, 'x_head': 3, 'y_head': 0, 'x_body': 3, 'y_body': 0, 'x_tail': 3, 'y_tail': 0},
+               {'frame': 1, 'id': 1, 'x_head': 7, 'y_head': 0, 'x_body': 7, 'y_body': 0, 'x_tail': 7, 'y_tail': 0}]]
+    params = {'max_move_distance': 5}
+    tracker, results = track_detections(frames, params | {'assignment': 'greedy'})
+    assert results[1] == {0: 1, 1: 2}
+    tracker, results = track_detections(frames, params | {'assignment': 'optimal'})
+    assert results[1] == {0: 0, 1: 1}
+
+
+def test_spatial_index():
+    frames = create_detections(n=50, size=300)
+    for assignment in ['greedy', 'optimal']:
+        _, expected = track_detections(frames, {'assignment': assignment})
+        _, results = track_detections(frames, {'assignment': assignment, 'spatial_index': True})
+        assert results == expected
+
+
+def test_track_state():
+    tracks = TrackState(capacity=2)
+    for track_id in range(3):
+        tracks.add(track_id, (track_id * 10, 0), 1, {}, 0)
+    assert list(tracks.items()) == [(0, 0), (1, 1), (2, 2)]
+    tracks.deltas[tracks.slots] = [[0, 10], [0, 1], [0, 0]]
+    tracks.predict(4)
+    assert np.all(tracks.positions[tracks.slots] == [[0, 0], [10, 0], [20, 0]])
+    tracks.predict(4)
+    assert np.allclose(tracks.positions[tracks.slots], [[0, 4], [10, 0.95], [20, 0]])
+    assert np.all(tracks.inactive_counts[tracks.slots] == 1)
+    tracks.last_active[1] = 1
+    tracks.expire(2, 2)
+    assert list(tracks.items()) == [(1, 1)]
+    tracks.add(3, (0, 0), 1, {}, 2)
+    assert list(tracks.items()) == [(1, 1), (3, 2)]
+
+
+def test_frame_features():
+    tracker = Tracker({'keypoints': ['head', 'body', 'tail']}, '', [], ['none.mp4'], None, None)
+    rows = [{'id': 0, 'x_head': 0, 'y_head': 0, 'x_body': 3, 'y_body': 4, 'x_tail': 3, 'y_tail': 8},
+            {'id': 1, 'x_head': 0, 'y_head': 0, 'x_body': None, 'y_body': None, 'x_tail': 6, 'y_tail': 8},
+            {'id': 2, 'x_head': None, 'y_head': None, 'x_body': None, 'y_body': None, 'x_tail': None, 'y_tail': None},
+            {'id': 0, 'x_head': 0, 'y_head': 0, 'x_body': 1, 'y_body': 0, 'x_tail': 2, 'y_tail': 0}]
+    detections = tracker.calc_frame_features(rows_to_columns(rows))
+    assert np.array_equal(detections['ids'], [0, 1])
+    assert np.allclose(detections['positions'], [[1, 0], [3, 4]])
+    assert np.allclose(detections['lengths'], [2, 10])
+    assert detections['rows'] == [rows[3], rows[1]]
+
+
+def test_frame_columns_iterator():
+    batches = [{'frame': [0, 0, 1], 'id': [0, 1, 0]}, {'frame': [1, 3], 'id': [1, 0]}, {'frame': [3], 'id': [1]}]
+    assert list(frame_columns_iterator(batches)) == [(0, {'frame': [0, 0], 'id': [0, 1]}, 0),
+                                                     (1, {'frame': [1, 1], 'id': [0, 1]}, 0),
+                                                     (3, {'frame': [3, 3], 'id': [0, 1]}, 1)]
+
+
+def test_checkpoint_resume(tmp_path):
+    input_file = write_detections(tmp_path / 'detections.feather', create_detections(nframes=60))
+    params = {'max_individuals': 100, 'move_distance': 4, 'max_move_distance': 10, 'max_inactive': 10,
+              'frame_end': 60, 'checkpoint_interval': 7}
+
+    expected_output = str(tmp_path / 'expected')
+    Tracker(params, '', [input_file], ['none.mp4'], expected_output, None).track()
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(framei, detections):
+        if framei == 40:
+            raise Interrupted()
+        track_frame(framei, detections)
+
+    output = str(tmp_path / 'tracked')
+    params |= {'profile': True, 'profile_interval': 10}
+    tracker = Tracker(params, '', [input_file], ['none.mp4'], output, None)
+    track_frame = tracker.track_frame
+    tracker.track_frame = interrupt
+    with pytest.raises(Interrupted):
+        tracker.track()
+    with open(output + '_profile.jsonl') as file:
+        profile_lines = file.readlines()
+    Tracker(params, '', [input_file], ['none.mp4'], output, None).track(resume=True)
+    # profile reports before interruption kept
+    with open(output + '_profile.jsonl') as file:
+        resumed_profile_lines = file.readlines()
+    assert len(profile_lines) > 0
+    assert resumed_profile_lines[:len(profile_lines)] == profile_lines
+    assert len(resumed_profile_lines) > len(profile_lines)
+
+    with open(output + '.csv') as file, open(expected_output + '.csv') as expected_file:
+        assert file.read() == expected_file.read()
+    assert pyarrow.feather.read_table(output + '.feather').equals(pyarrow.feather.read_table(expected_output + '.feather'))
+    with pyarrow.ipc.open_stream(output + '_stream.feather') as reader, \
+            pyarrow.ipc.open_stream(expected_output + '_stream.feather') as expected_reader:
+        assert reader.read_all().equals(expected_reader.read_all())
+
+
+def test_checkpoint_interval(tmp_path):
+    # interval in video frames, independent of frame interval
+    checkpoint_frames = []
+    tracker = Tracker({'frame_end': 40, 'frame_interval': 2, 'checkpoint_interval': 8}, '', [], [],
+                      str(tmp_path / 'tracked'), None)
+    tracker.save_checkpoint = lambda filename, framei, *args, **kwargs: checkpoint_frames.append(framei)
+    tracker.track([])
+    assert checkpoint_frames == [6, 14, 22, 30, 38, 40]
+
+
+def test_chunk_tracking(tmp_path):
+    # random order: track ids of independent chunks differ
+    input_file = write_detections(tmp_path / 'detections.feather', create_detections(nframes=90), shuffle=True)
+    params = {'max_individuals': 100, 'move_distance': 4, 'max_move_distance': 10, 'max_inactive': 10,
+              'frame_end': 90, 'chunks': 3, 'chunk_overlap': 10, 'workers': 2, 'id_label': 'id'}
+    output = str(tmp_path / 'tracked')
+    Tracker(params, '', [input_file], ['none.mp4'], output, None).track_chunks()
+    table = pyarrow.feather.read_table(output + '.feather').to_pydict()
+    assert len(table['frame']) == 90 * 20
+    assert np.all(np.diff(table['frame']) >= 0)
+    # each individual keeps a single track id across chunks
+    pairs = set(zip(table['id'], table['track_id']))
+    assert len(pairs) == 20
+    assert len(set(track_id for _, track_id in pairs)) == 20
+
+    # finished chunks skipped only when tracked with the same params
+    chunk_info_file = tmp_path / 'tracked_chunk0_info.json'
+    chunk_info_time = chunk_info_file.stat().st_mtime_ns
+    Tracker(params, '', [input_file], ['none.mp4'], output, None).track_chunks()
+    assert chunk_info_file.stat().st_mtime_ns == chunk_info_time
+    Tracker(params | {'max_move_distance': 0.5}, '', [input_file], ['none.mp4'], output, None).track_chunks()
+    table = pyarrow.feather.read_table(output + '.feather').to_pydict()
+    assert len(set(table['track_id'])) > 20
+
+
+def test_sweep_tracking(tmp_path):
+    frames = create_detections(nframes=50)
+    write_detections(tmp_path / 'detections.feather', frames)
+    write_detections(tmp_path / 'annotation.feather',
+                     [[{'frame': detection['frame'], 'track_id': detection['id'],
+                        'x_body': detection['x_body'], 'y_body': detection['y_body']} for detection in detections]
+                      for detections in frames])
+
+    all_params = {'general': {'base_dir': str(tmp_path)}}
+    params = {'input': 'detections.feather', 'annotation': 'annotation.feather', 'output': 'sweep',
+              'max_individuals': 100, 'move_distance': 4, 'max_inactive': 10, 'workers': 2,
+              'sweep': {'max_move_distance': [0.5, 10], 'min_active': [0, 10]}}
+    sweep_tracking.run(all_params, params)
+    with open(tmp_path / 'sweep.csv') as file:
+        results = list(csv.DictReader(file))
+    assert len(results) == 4
+    for result in results:
+        if float(result['max_move_distance']) == 10:
+            assert int(result['tracks']) == 20
+            assert float(result['match_rate']) == 1
+        else:
+            assert int(result['tracks']) > 20
+            assert float(result['match_rate']) < 1
+
+
+def test_tracker_frame_range():
+    assert Tracker({'frame_end': 10}, '', [], [], None, None).frame_end == 10
+    with pytest.raises(ValueError):
+        Tracker({}, '', [], [], None, None)
+    with pytest.raises(ValueError):
+        Tracker({'frame_end': 10}, '', [], [], None, 'tracked.mp4')
+
+
+def test_quantile_sketch():
+    values = np.random.default_rng(0).exponential(5, 10000)
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for part in np.array_split(values, 10):
+        sketch.add(part)
+    sketch.add([0, 0])
+    for q in [0.1, 0.5, 0.9, 0.99]:
+        expected = np.quantile(np.concatenate([values, [0, 0]]), q)
+        assert abs(sketch.quantile(q) - expected) <= 0.02 * expected
+
+
+def test_debug_stats(tmp_path):
+    input_file = write_detections(tmp_path / 'detections.feather', create_detections(nframes=30))
+    params = {'max_individuals': 10, 'move_distance': 4, 'max_move_distance': 10, 'max_inactive': 5,
+              'frame_end': 30, 'debug_interval': 10, 'debug_sample_rate': 0.5}
+    output = str(tmp_path / 'tracked')
+    Tracker(params, '', [input_file], ['none.mp4'], output, None, debug_mode=True).track()
+    with open(output + '_debug_summary.jsonl') as file:
+        summaries = [json.loads(line) for line in file]
+    assert [summary['frames'] for summary in summaries] == [10, 10, 10]
+    # 20 individuals, 10 tracks
+    assert summaries[0]['births'] == 10
+    assert sum(summary['births_rejected'] for summary in summaries) == 20 * 30 - 10 * 30
+    assert sum(summary['matches'] for summary in summaries) == 10 * 29
+    assert summaries[0]['distance']['quantiles']['p50'] < 4
+    assert sum(summaries[1]['distance']['histogram']['counts']) == summaries[1]['matches']
+    with open(output + '_debug.csv') as file:
+        rows = list(csv.DictReader(file))
+    assert 0 < len(rows) < 10 * 29